@@ -0,0 +1,200 @@
+"""
+Pickling from asyncio code
+The examples in serialization.py follow the classic pattern:
+
+with open("multidata.pckl", "wb") as file_out:
+    pickle.dump(a_dict, file_out)
+
+Both the pickling and the file write block the calling thread. In an asyncio program that thread also runs the event loop, so while a big object is being dumped, no other coroutine can make progress - the whole service stalls.
+
+The coroutines below move the blocking work to a thread pool with loop.run_in_executor():
+
+await adump(obj, path) - pickles obj and writes it to path;
+await aappend(obj, path) - appends one more pickle to path (a multi-object stream like multidata.pckl);
+await aload(path) - loads the first object from path;
+async for obj in aload_all(path) - iterates over all the objects of a multi-object stream.
+
+The pool is bounded (four threads by default), so a burst of requests can't create an unlimited number of threads. Writes to the same file are serialized with an asyncio.Lock per path, so two coroutines can never interleave their bytes in one file; the pickling itself happens before the lock is taken. A coroutine cancelled while its thread is writing still holds the lock until the thread is done, since the thread itself can't be stopped. Readers take the same lock, aload_all() once per object, so they never see a half-written pickle, and a stream that ends in the middle of a pickle raises EOFError instead of looking shorter than it is. An asyncio.Lock belongs to the event loop it's used in, so the locks are kept per running loop, and a lock is dropped as soon as nobody holds or waits for it.
+
+Every operation is timed; stats() returns the count, average and maximum latency per operation.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import asyncio
+import contextlib
+import os
+import pickle
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+_executor = None
+_locks = weakref.WeakKeyDictionary()  # event loop -> {path: [lock, users]}
+_stats = {}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="async-pickle")
+    return _executor
+
+
+def set_executor(executor):
+    """Use your own executor, e.g. with a different number of workers."""
+    global _executor
+    _executor = executor
+
+
+@contextlib.asynccontextmanager
+async def _locked(path):
+    locks = _locks.setdefault(asyncio.get_running_loop(), {})
+    key = os.path.abspath(path)
+    entry = locks.get(key)
+    if entry is None:
+        entry = locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del locks[key]
+
+
+def _record(operation, elapsed):
+    count, total, worst = _stats.get(operation, (0, 0.0, 0.0))
+    _stats[operation] = (count + 1, total + elapsed, max(worst, elapsed))
+
+
+def stats():
+    return {
+        operation: {"count": count, "avg_s": total / count, "max_s": worst}
+        for operation, (count, total, worst) in _stats.items()
+    }
+
+
+def reset_stats():
+    _stats.clear()
+
+
+async def _run(operation, func, *args):
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    finally:
+        _record(operation, time.perf_counter() - start)
+
+
+async def _run_locked(operation, path, func, *args):
+    async with _locked(path):
+        task = asyncio.ensure_future(_run(operation, func, *args))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # the thread can't be stopped: keep the lock until it is done with the file,
+            # or the next writer would interleave its bytes with ours
+            while not task.done():
+                try:
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    pass
+            if not task.cancelled():
+                task.exception()
+            raise
+
+
+def _write(path, mode, data):
+    with open(path, mode) as file_out:
+        file_out.write(data)
+
+
+def _read(path):
+    with open(path, "rb") as file_in:
+        return pickle.load(file_in)
+
+
+async def _dump(operation, obj, path, mode, protocol):
+    # pickling doesn't touch the file, so only the write itself holds the lock
+    data = await _run("pickle", pickle.dumps, obj, protocol)
+    await _run_locked(operation, path, _write, path, mode, data)
+
+
+async def adump(obj, path, protocol=None):
+    await _dump("dump", obj, path, "wb", protocol)
+
+
+async def aappend(obj, path, protocol=None):
+    await _dump("append", obj, path, "ab", protocol)
+
+
+async def aload(path):
+    # waits for a write in progress, so it never sees a half-written pickle
+    return await _run_locked("load", path, _read, path)
+
+
+def _load_next(file_in):
+    # only a clean end of the stream ends it; EOFError in the middle of a pickle is an error
+    if not file_in.peek(1):
+        return False, None
+    return True, pickle.load(file_in)
+
+
+async def aload_all(path):
+    file_in = await asyncio.get_running_loop().run_in_executor(get_executor(), open, path, "rb")
+    try:
+        while True:
+            found, obj = await _run_locked("load_next", path, _load_next, file_in)
+            if not found:
+                return
+            yield obj
+    finally:
+        file_in.close()
+
+
+if __name__ == "__main__":
+
+    async def heartbeat(stop):
+        # measures how late the event loop wakes us up while the dumps are running
+        worst = 0.0
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - start - 0.01)
+        return worst
+
+    async def main():
+        a_dict = dict()
+        a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+        a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+        a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+        a_list = ["a", 123, [10, 100, 1000]]
+
+        await adump(a_dict, "async_multidata.pckl")
+        await aappend(a_list, "async_multidata.pckl")
+        async for data in aload_all("async_multidata.pckl"):
+            print(type(data), data)
+
+        big = [{"id": i, "rates": dict(a_dict)} for i in range(200000)]
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(stop))
+        await asyncio.gather(*(aappend(big[i::8], "big.pckl") for i in range(8)))
+        stop.set()
+        print("worst event loop delay during the dumps: {:.1f} ms".format(await beat * 1000))
+
+        count = 0
+        async for part in aload_all("big.pckl"):
+            count += len(part)
+        print("objects read back:", count)
+        os.remove("big.pckl")
+
+        for operation, row in stats().items():
+            print("{:>10}: {count} ops, avg {avg_s:.4f} s, max {max_s:.4f} s".format(operation, **row))
+
+    asyncio.run(main())
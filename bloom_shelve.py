@@ -0,0 +1,248 @@
+"""
+A Bloom filter in front of a shelf
+When most lookups on a shelf are for keys that aren't there ('in' checks, get() with a default), every miss still goes down to the database: dbm.gnu and dbm.ndbm look the key up in their on-disk index, dbm.dumb in an index it has to keep entirely in memory, and shelf[key] additionally pays for raising and catching a KeyError.
+
+A Bloom filter answers 'is this key in the set?' with either 'definitely not' or 'maybe', using a few bits per key. A key is hashed to k positions in an array of m bits; adding it sets those bits, and looking it up checks them - if any one is 0, the key was never added. The bits of other keys can all happen to be set, so 'maybe' is sometimes wrong (a false positive); with m and k chosen for the number of keys (capacity) and the wanted error_rate, it is wrong with about that probability:
+
+m = -capacity * ln(error_rate) / ln(2)**2        k = m / capacity * ln(2)
+
+BloomShelf checks the filter before the database, so a definite miss costs a couple of hash computations and never touches dbm. The k positions come from one blake2b digest split in two 64-bit halves (h1 + i * h2), which is stable across processes - unlike hash() - so the filter can be saved.
+
+How much that saves depends on the database. With dbm.gnu or dbm.ndbm a miss can cost a disk read, which is orders of magnitude more than the filter. dbm.dumb, however, keeps its whole index in a Python dictionary, and a dictionary lookup is faster than computing bit positions in pure Python: on a dbm.dumb shelf the filter makes misses several times slower. BloomShelf therefore only uses the filter when the database isn't dbm.dumb, unless use_filter=True asks for it anyway (use_filter=False turns it off everywhere); without a filter it's a plain shelf, and a '.bloom' file left from earlier is deleted since it would no longer follow the changes. The demo at the bottom prints which database it ran on and compares both.
+
+The filter is kept in sync on every assignment and saved into a '.bloom' file next to the shelf on sync() and close(), as plain data that doesn't depend on any class:
+
+header   b"BLOOMSH1", capacity, error_rate, number of keys added
+bits     the bit array
+
+A saved filter is reused when its capacity is at least the capacity asked for and its error_rate is the same; otherwise the filter is rebuilt. A '.bloom.dirty' marker is created by the first change after saving and removed by the next save; if it's there when the shelf is opened, the program crashed in between and the filter is rebuilt from the keys. A Bloom filter can't forget a key, so deleted keys stay 'maybe', and once more keys than capacity were added the error rate climbs: rebuild() builds a new filter from the current keys, and is called automatically with twice the capacity when the filter is full.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import dbm.dumb
+import hashlib
+import math
+import os
+import shelve
+import struct
+
+MAGIC = b"BLOOMSH1"
+HEADER = struct.Struct("<8sQdQ")
+
+
+class BloomFilter:
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "little")
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64 | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Adds key (bytes)."""
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        # same positions as _positions(), but a miss usually stops at the first or second bit
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "little")
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64 | 1
+        bits = self.bits
+        size = self.size
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
+
+    def save(self, path):
+        with open(path, "wb") as file_out:
+            file_out.write(HEADER.pack(MAGIC, self.capacity, self.error_rate, self.count))
+            file_out.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a filter written by save(), or returns None if the file isn't one."""
+        with open(path, "rb") as file_in:
+            data = file_in.read()
+        if len(data) < HEADER.size:
+            return None
+        magic, capacity, error_rate, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return None
+        bloom = cls(capacity, error_rate)
+        if len(data) - HEADER.size != len(bloom.bits):
+            return None
+        bloom.bits[:] = data[HEADER.size:]
+        bloom.count = count
+        return bloom
+
+
+class BloomShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, capacity=100000, error_rate=0.01, use_filter=None):
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        self.bloom_path = filename + ".bloom"
+        self.readonly = flag == "r"
+        self.filtered = 0
+        self.false_positives = 0
+        self.hits = 0
+        self._marked = False
+        self.filter = None
+        if use_filter is None:
+            # dbm.dumb answers a miss from an in-memory dict, faster than the filter can
+            use_filter = not isinstance(self.dict, dbm.dumb._Database)
+        if not use_filter:
+            if not self.readonly:
+                for path in (self.bloom_path, self.bloom_path + ".dirty"):
+                    if os.path.exists(path):
+                        os.remove(path)
+            return
+        if flag != "n" and os.path.exists(self.bloom_path) and not os.path.exists(self.bloom_path + ".dirty"):
+            self.filter = BloomFilter.load(self.bloom_path)
+        # a filter that grew past capacity is still good
+        if self.filter is None or self.filter.capacity < capacity or self.filter.error_rate != error_rate:
+            self.rebuild(capacity, error_rate)
+
+    def rebuild(self, capacity=None, error_rate=None):
+        """Builds a new filter from the keys of the shelf."""
+        capacity = max(capacity or self.filter.capacity, len(self.dict))
+        self.filter = BloomFilter(capacity, error_rate or self.filter.error_rate)
+        for key in self.dict.keys():
+            self.filter.add(key)
+        self._mark()
+
+    def _mark(self):
+        if not self._marked and not self.readonly:
+            open(self.bloom_path + ".dirty", "wb").close()
+            self._marked = True
+
+    def _maybe(self, key):
+        if key.encode(self.keyencoding) in self.filter:
+            return True
+        self.filtered += 1
+        return False
+
+    def __contains__(self, key):
+        if self.filter is None:
+            return shelve.Shelf.__contains__(self, key)
+        if not self._maybe(key):
+            return False
+        if shelve.Shelf.__contains__(self, key):
+            self.hits += 1
+            return True
+        self.false_positives += 1
+        return False
+
+    def __getitem__(self, key):
+        if self.filter is None:
+            return shelve.Shelf.__getitem__(self, key)
+        if not self._maybe(key):
+            raise KeyError(key)
+        try:
+            value = shelve.Shelf.__getitem__(self, key)
+        except KeyError:
+            self.false_positives += 1
+            raise
+        self.hits += 1
+        return value
+
+    def get(self, key, default=None):
+        if self.filter is None:
+            return shelve.Shelf.get(self, key, default)
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        # marked before the write: dbm.dumb persists it at once, and a crash right after it must not
+        # leave a saved filter that doesn't know the key
+        if self.filter is None:
+            shelve.Shelf.__setitem__(self, key, value)
+            return
+        self._mark()
+        shelve.Shelf.__setitem__(self, key, value)
+        self.filter.add(key.encode(self.keyencoding))
+        if self.filter.count > self.filter.capacity:
+            self.rebuild(2 * self.filter.capacity)
+
+    def stats(self):
+        bloom = self.filter
+        return {
+            "filtered": self.filtered,
+            "false_positives": self.false_positives,
+            "hits": self.hits,
+            "keys_added": bloom.count if bloom else 0,
+            "bits": bloom.size if bloom else 0,
+            "hashes": bloom.hashes if bloom else 0,
+        }
+
+    def sync(self):
+        shelve.Shelf.sync(self)
+        if self._marked and not isinstance(self.dict, shelve._ClosedDict):
+            self.filter.save(self.bloom_path + ".tmp")
+            os.replace(self.bloom_path + ".tmp", self.bloom_path)
+            os.remove(self.bloom_path + ".dirty")
+            self._marked = False
+
+
+def open_bloom(filename, flag="c", protocol=None, capacity=100000, error_rate=0.01, use_filter=None):
+    return BloomShelf(filename, flag, protocol, capacity, error_rate, use_filter)
+
+
+if __name__ == "__main__":
+    import glob
+    import time
+
+    shelve_name = "first_shelve.shlv"
+
+    with open_bloom(shelve_name, flag="n", capacity=1000) as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    with open_bloom(shelve_name, flag="r", capacity=1000) as my_shelve:
+        print("USD" in my_shelve, "XYZ" in my_shelve, my_shelve.get("ABC"), my_shelve.stats())
+
+    KEYS = 100000
+    with open_bloom("test_bloom", flag="n", capacity=KEYS, use_filter=True) as shelf:
+        for i in range(KEYS):
+            shelf["key{}".format(i)] = i
+
+    print("database:", dbm.whichdb("test_bloom"))
+    missing = ["other{}".format(i) for i in range(200000)]
+    openers = (
+        ("plain shelf", shelve.open),
+        ("bloom shelf", open_bloom),
+        ("bloom shelf, filter forced", lambda name, flag: open_bloom(name, flag, use_filter=True)),
+    )
+    for name, opener in openers:
+        with opener("test_bloom", flag="r") as shelf:
+            start = time.perf_counter()
+            found = sum(1 for key in missing if key in shelf)
+            contains = time.perf_counter() - start
+            start = time.perf_counter()
+            found += sum(1 for key in missing if shelf.get(key) is not None)
+            get = time.perf_counter() - start
+            print("{}: 'in' {:.0f} misses/s, get() {:.0f} misses/s".format(
+                name, len(missing) / contains, len(missing) / get))
+            if isinstance(shelf, BloomShelf) and shelf.filter is not None:
+                stats = shelf.stats()
+                print("  false positive rate: {:.2%}".format(stats["false_positives"] / (2 * len(missing))), stats)
+
+    for path in glob.glob("test_bloom*"):
+        os.remove(path)
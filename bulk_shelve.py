@@ -0,0 +1,176 @@
+"""
+Bulk loading and dumping of shelves
+Copying a shelf item by item (new_shelve[key] = value) is slow for big shelves, and most of the time isn't spent pickling. The dbm.dumb module behind shelve on most systems opens the '.dat' file, pads it to a 512-byte block and appends the value, then opens the '.dir' file and appends a line for the new key - two file opens for every single item. Reading is no better: every lookup opens the '.dat' file again.
+
+bulk_load(shelf, pairs) takes the (key, value) pairs in batches:
+
+every value of a batch is pickled first, in one tight loop;
+the batch is sorted by key, so the values are laid out in key order instead of arrival order;
+for a dbm.dumb shelf, the new values of a batch are appended to the '.dat' file through a single open file, and the '.dir' index is written once at the end (existing keys go through the normal path, so their space is reused as usual);
+for any other database, the pickled bytes are stored directly in shelf.dict, skipping the shelf's own cache.
+
+bulk_dump(shelf, path) writes the shelf to a multi-object pickle file like multidata.pckl, as key, value, key, value, ... The values are copied as the pickled bytes they are stored as, so nothing is unpickled and pickled again, and a dbm.dumb '.dat' file is read in one sequential pass in file order. read_dump(path) yields the (key, value) pairs back, so bulk_load(shelf, read_dump(path)) restores a dump.
+
+Both accept a progress(count, seconds) callback, called after every batch, and return {"items", "bytes", "seconds", "items_per_second"}.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm.dumb
+import itertools
+import pickle
+import time
+
+BATCH_SIZE = 10000
+
+
+def _stats(count, size, start):
+    elapsed = time.perf_counter() - start
+    return {"items": count, "bytes": size, "seconds": elapsed, "items_per_second": count / elapsed if elapsed else 0.0}
+
+
+def _append_dumb(db, batch):
+    """Appends the values of new keys to a dbm.dumb database through one open file."""
+    blocksize = dbm.dumb._BLOCKSIZE
+    with open(db._datfile, "rb+") as file_out:
+        pos = file_out.seek(0, 2)
+        for key, data in batch:
+            start = (pos + blocksize - 1) // blocksize * blocksize
+            file_out.write(b"\0" * (start - pos))
+            file_out.write(data)
+            db._index[key] = (start, len(data))
+            pos = start + len(data)
+    db._modified = True
+
+
+def bulk_load(shelf, pairs, batch_size=BATCH_SIZE, progress=None):
+    """Stores the (key, value) pairs in shelf and returns throughput statistics."""
+    db = shelf.dict
+    dumb = isinstance(db, dbm.dumb._Database)
+    if dumb and db._readonly:
+        # the fast path writes past dbm.dumb's own checks
+        raise dbm.dumb.error("The database is opened for reading only")
+    protocol = shelf._protocol
+    count = size = 0
+    start = time.perf_counter()
+    pairs = iter(pairs)
+    while True:
+        batch = [
+            (key.encode(shelf.keyencoding), pickle.dumps(value, protocol))
+            for key, value in itertools.islice(pairs, batch_size)
+        ]
+        if not batch:
+            break
+        batch.sort(key=lambda item: item[0])
+        if dumb:
+            new = []
+            for key, data in batch:
+                if key in db._index:
+                    db[key] = data
+                else:
+                    new.append((key, data))
+            _append_dumb(db, new)
+        else:
+            for key, data in batch:
+                db[key] = data
+        if shelf.writeback:
+            for key, data in batch:
+                shelf.cache.pop(key.decode(shelf.keyencoding), None)
+        count += len(batch)
+        size += sum(len(data) for key, data in batch)
+        if progress is not None:
+            progress(count, time.perf_counter() - start)
+    if hasattr(db, "sync"):
+        db.sync()
+    return _stats(count, size, start)
+
+
+def _raw_items(shelf):
+    """Yields the (key, pickled value) pairs of the shelf, in file order for dbm.dumb."""
+    shelf.sync()
+    db = shelf.dict
+    if isinstance(db, dbm.dumb._Database):
+        with open(db._datfile, "rb") as file_in:
+            for key, (pos, length) in sorted(db._index.items(), key=lambda item: item[1][0]):
+                file_in.seek(pos)
+                yield key, file_in.read(length)
+    else:
+        for key in db.keys():
+            yield key, db[key]
+
+
+def bulk_dump(shelf, path, batch_size=BATCH_SIZE, progress=None):
+    """Writes the shelf to path as a key, value, key, value, ... pickle stream."""
+    count = size = 0
+    start = time.perf_counter()
+    items = _raw_items(shelf)
+    with open(path, "wb") as file_out:
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                break
+            chunks = []
+            for key, data in batch:
+                chunks.append(pickle.dumps(key.decode(shelf.keyencoding), pickle.HIGHEST_PROTOCOL))
+                chunks.append(data)
+            data = b"".join(chunks)
+            file_out.write(data)
+            count += len(batch)
+            size += len(data)
+            if progress is not None:
+                progress(count, time.perf_counter() - start)
+    return _stats(count, size, start)
+
+
+def read_dump(path):
+    """Yields the (key, value) pairs of a file written by bulk_dump()."""
+    with open(path, "rb") as file_in:
+        while True:
+            try:
+                key = pickle.load(file_in)
+            except EOFError:
+                return
+            yield key, pickle.load(file_in)
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+    import shelve
+
+    def report(count, seconds):
+        if count % 100000 == 0:
+            print("  {} items, {:.0f} items/s".format(count, count / seconds))
+
+    with shelve.open("first_shelve.shlv", flag="n") as my_shelve:
+        bulk_load(my_shelve, [
+            ("EUR", {"code": "Euro", "symbol": "€"}),
+            ("GBP", {"code": "Pounds sterling", "symbol": "£"}),
+            ("USD", {"code": "US dollar", "symbol": "$"}),
+            ("JPY", {"code": "Japanese yen", "symbol": "¥"}),
+        ])
+        bulk_dump(my_shelve, "currencies.dump")
+    print(dict(read_dump("currencies.dump")))
+
+    N = 300000
+
+    def items():
+        for i in range(N):
+            yield "key{:07d}".format(i), {"id": i, "code": "Euro", "symbol": "€"}
+
+    start = time.perf_counter()
+    with shelve.open("test_plain", flag="n") as shelf:
+        for key, value in itertools.islice(items(), 30000):
+            shelf[key] = value
+    print("item by item: {:.0f} items/s".format(30000 / (time.perf_counter() - start)))
+
+    with shelve.open("test_bulk", flag="n") as shelf:
+        print("bulk_load:", bulk_load(shelf, items(), progress=report))
+    with shelve.open("test_bulk", flag="r") as shelf:
+        print("bulk_dump:", bulk_dump(shelf, "test_bulk.pckl", progress=report))
+    with shelve.open("test_copy", flag="n") as shelf:
+        print("bulk_load from dump:", bulk_load(shelf, read_dump("test_bulk.pckl")))
+        assert shelf["key0123456"]["id"] == 123456 and len(shelf) == N
+
+    for path in glob.glob("test_plain*") + glob.glob("test_bulk*") + glob.glob("test_copy*"):
+        os.remove(path)
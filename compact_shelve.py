@@ -0,0 +1,169 @@
+"""
+Compacting dbm.dumb shelves
+The test.dat / test.dir / test.bak files written by shelve_module.py come from dbm.dumb, the pure Python database used when no other dbm module is installed. Its '.dat' file is a sequence of 512-byte blocks and the '.dir' file says where each value starts and how long it is. dbm.dumb never gives space back:
+
+a deleted value stays in the '.dat' file, only its '.dir' line disappears;
+a value that no longer fits in its old blocks is appended at the end, and the old blocks are abandoned.
+
+A shelf that is updated for a long time keeps growing even if the number of items doesn't. compact(path) copies only the live values, in file order, into a fresh '.dat' file with a matching '.dir' file, then swaps them in. The two files can't be replaced in a single atomic step, so a small '.compacting' marker is written before the swap and removed after it: if the program dies in between, the next compact() or CompactingShelf finds the marker and completes the swap (recover()).
+
+fragmentation(path) is the share of the '.dat' file that isn't used by live values. CompactingShelf is the online mode: it checks the fragmentation every check_every writes and compacts itself, without closing the shelf, as soon as it reaches the threshold. With writeback=True, sync() writes the cached entries back one by one; a check falling due in the middle of that waits until sync() has written them all.
+
+The database must not be open in another process while it is compacted.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm.dumb
+import os
+import shelve
+
+BLOCKSIZE = dbm.dumb._BLOCKSIZE
+
+
+def _padded(size):
+    return (size + BLOCKSIZE - 1) // BLOCKSIZE * BLOCKSIZE
+
+
+def _fragmentation(index, path):
+    size = os.path.getsize(path + ".dat")
+    if not size:
+        return 0.0
+    live = sum(_padded(length) for pos, length in index.values())
+    return max(0.0, 1 - live / size)
+
+
+def fragmentation(path):
+    """The share of path.dat (between 0.0 and 1.0) not used by live values."""
+    recover(path)
+    with dbm.dumb.open(path, "r") as db:
+        return _fragmentation(db._index, path)
+
+
+def recover(path):
+    """Completes a swap interrupted by a crash, or removes the files of an unfinished compaction."""
+    if os.path.exists(path + ".compacting"):
+        for suffix in (".dat", ".dir"):
+            if os.path.exists(path + suffix + ".compact"):
+                os.replace(path + suffix + ".compact", path + suffix)
+        os.remove(path + ".compacting")
+    else:
+        for suffix in (".dat", ".dir"):
+            if os.path.exists(path + suffix + ".compact"):
+                os.remove(path + suffix + ".compact")
+
+
+def compact(path):
+    """Rewrites path.dat with only the live values and returns the space reclaimed."""
+    recover(path)
+    before = os.path.getsize(path + ".dat")
+    with dbm.dumb.open(path, "r") as db:
+        entries = sorted(db._index.items(), key=lambda item: item[1][0])
+    index = []
+    with open(path + ".dat", "rb") as file_in, open(path + ".dat.compact", "wb") as file_out:
+        for key, (pos, length) in entries:
+            file_in.seek(pos)
+            data = file_in.read(length)
+            index.append((key, (file_out.tell(), length)))
+            file_out.write(data)
+            file_out.write(b"\0" * (_padded(length) - length))
+        os.fsync(file_out.fileno())
+    with open(path + ".dir.compact", "w", encoding="Latin-1") as file_out:
+        for key, pos_and_size in index:
+            file_out.write("%r, %r\n" % (key.decode("Latin-1"), pos_and_size))
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    open(path + ".compacting", "wb").close()
+    recover(path)
+    if os.path.exists(path + ".bak"):
+        os.remove(path + ".bak")
+    after = os.path.getsize(path + ".dat")
+    return {"records": len(index), "before": before, "after": after, "reclaimed": before - after}
+
+
+class CompactingShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, writeback=False, threshold=0.5, min_size=2**20, check_every=1000):
+        if os.path.exists(filename + ".dat"):
+            recover(filename)
+        shelve.Shelf.__init__(self, dbm.dumb.open(filename, flag), protocol, writeback)
+        self.filename = filename
+        self.threshold = threshold
+        self.min_size = min_size
+        self.check_every = check_every
+        self.compactions = []
+        self._writes = 0
+        self._syncing = False
+        self._check_due = False
+
+    def fragmentation(self):
+        return _fragmentation(self.dict._index, self.filename)
+
+    def compact(self):
+        """Compacts the shelf now, keeping it open."""
+        self.sync()
+        self.dict.close()
+        try:
+            report = compact(self.filename)
+        finally:
+            self.dict = dbm.dumb.open(self.filename, "w")
+        self.compactions.append(report)
+        return report
+
+    def _check(self):
+        if os.path.getsize(self.filename + ".dat") >= self.min_size and self.fragmentation() >= self.threshold:
+            self.compact()
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % self.check_every:
+            return
+        if self._syncing:
+            # compacting now would close the database under Shelf.sync(), which is still writing the cache back
+            self._check_due = True
+        else:
+            self._check()
+
+    def sync(self):
+        self._syncing = True
+        try:
+            shelve.Shelf.sync(self)
+        finally:
+            self._syncing = False
+        if self._check_due:
+            self._check_due = False
+            self._check()
+
+    def __setitem__(self, key, value):
+        shelve.Shelf.__setitem__(self, key, value)
+        self._written()
+
+    def __delitem__(self, key):
+        shelve.Shelf.__delitem__(self, key)
+        self._written()
+
+
+def open_compacting(filename, flag="c", protocol=None, writeback=False, threshold=0.5, min_size=2**20, check_every=1000):
+    return CompactingShelf(filename, flag, protocol, writeback, threshold, min_size, check_every)
+
+
+if __name__ == "__main__":
+    with shelve.Shelf(dbm.dumb.open("test_compact", "n")) as shelvi:
+        shelvi["username"] = "Hafedh Gunichi"
+        for round in range(20):
+            for i in range(500):
+                shelvi["user{}".format(i)] = {"id": i, "history": list(range(round * 50))}
+        for i in range(250):
+            del shelvi["user{}".format(i)]
+
+    print("fragmentation: {:.0%}".format(fragmentation("test_compact")))
+    print(compact("test_compact"))
+    print("fragmentation: {:.0%}".format(fragmentation("test_compact")))
+    with shelve.Shelf(dbm.dumb.open("test_compact", "r")) as shelvi:
+        print(shelvi["username"], len(shelvi), shelvi["user499"]["history"][-1])
+
+    with open_compacting("test_online", flag="n", threshold=0.5, min_size=2**18) as shelvi:
+        for round in range(20):
+            for i in range(500):
+                shelvi["user{}".format(i)] = {"id": i, "history": list(range(round * 50))}
+        print("online compactions:", len(shelvi.compactions), "reclaimed:", sum(report["reclaimed"] for report in shelvi.compactions))
+        print("size now:", os.path.getsize("test_online.dat"), "fragmentation: {:.0%}".format(shelvi.fragmentation()))
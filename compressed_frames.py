@@ -0,0 +1,222 @@
+"""
+Compressing pickles and shelves frame by frame
+The files produced by serialization.py (multidata.pckl, cucumber.pckl) and by shelve_module.py (the .dat files) are stored uncompressed.
+
+You could simply wrap the whole file in gzip.open(), but then the file becomes one long compressed stream: to read the 1000th object you must decompress the 999 objects in front of it.
+
+The trick is to compress every record independently and call the result a 'frame'. Each frame carries a small header:
+
+1 byte  - the codec used for this frame (0 means 'stored raw');
+4 bytes - the length of the (possibly compressed) payload.
+
+A pickle file written this way ends with an index of frame offsets, so any record can be reached with a single seek(). A shelve value is already an independent record, so for shelves it's enough to compress each value before it is handed to dbm.
+
+The codecs come from the standard library: zlib, bz2 and lzma. The codec is chosen per file (or per shelf), but every frame remembers its own codec, because in 'adaptive' mode small or incompressible payloads are stored raw - compressing 30 bytes usually makes them bigger.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import bz2
+import dbm
+import io
+import lzma
+import pickle
+import shelve
+import struct
+import time
+import zlib
+
+CODECS = {
+    "none": (0, None, None),
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "bz2": (2, bz2.compress, bz2.decompress),
+    "lzma": (3, lzma.compress, lzma.decompress),
+}
+_BY_ID = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+MAGIC = b"PCZF"
+FRAME_HEADER = struct.Struct("<BI")
+TRAILER = struct.Struct("<QI")
+
+# payloads shorter than this are never worth compressing
+MIN_SIZE = 64
+# a compressed frame must be at most this fraction of the raw one to be kept
+MAX_RATIO = 0.9
+
+
+def encode_frame(payload, codec="zlib", adaptive=True):
+    codec_id, compress, _ = CODECS[codec]
+    if compress is not None and not (adaptive and len(payload) < MIN_SIZE):
+        packed = compress(payload)
+        if not adaptive or len(packed) <= len(payload) * MAX_RATIO:
+            return FRAME_HEADER.pack(codec_id, len(packed)) + packed
+    return FRAME_HEADER.pack(0, len(payload)) + payload
+
+
+def decode_frame(frame):
+    codec_id, length = FRAME_HEADER.unpack_from(frame)
+    payload = frame[FRAME_HEADER.size:FRAME_HEADER.size + length]
+    decompress = CODECS[_BY_ID[codec_id]][2]
+    return payload if decompress is None else decompress(payload)
+
+
+def read_frame(file):
+    header = file.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    _, length = FRAME_HEADER.unpack(header)
+    return decode_frame(header + file.read(length))
+
+
+class FramedWriter:
+    """Writes pickled objects to a file, one compressed frame per object."""
+
+    def __init__(self, filename, codec="zlib", adaptive=True, protocol=None):
+        if codec not in CODECS:
+            raise ValueError("unknown codec: {}".format(codec))
+        self.codec = codec
+        self.adaptive = adaptive
+        self.protocol = protocol
+        self.offsets = []
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC + bytes([CODECS[codec][0]]))
+
+    def dump(self, obj):
+        self.offsets.append(self.file.tell())
+        payload = pickle.dumps(obj, self.protocol)
+        self.file.write(encode_frame(payload, self.codec, self.adaptive))
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(struct.pack("<{}Q".format(len(self.offsets)), *self.offsets))
+        self.file.write(TRAILER.pack(index_offset, len(self.offsets)))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class FramedReader:
+    """Random access to the objects stored by FramedWriter."""
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        header = self.file.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            self.file.close()
+            raise pickle.UnpicklingError("not a framed pickle file: {}".format(filename))
+        self.codec = _BY_ID[header[len(MAGIC)]]
+        self.file.seek(-TRAILER.size, io.SEEK_END)
+        index_offset, count = TRAILER.unpack(self.file.read(TRAILER.size))
+        self.file.seek(index_offset)
+        self.offsets = struct.unpack("<{}Q".format(count), self.file.read(8 * count))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        self.file.seek(self.offsets[index])
+        return pickle.loads(read_frame(self.file))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class CompressedShelf(shelve.Shelf):
+    """A shelf whose values are stored as independently compressed frames."""
+
+    def __init__(self, dict, codec="zlib", adaptive=True, protocol=None, writeback=False, keyencoding="utf-8"):
+        if codec not in CODECS:
+            raise ValueError("unknown codec: {}".format(codec))
+        shelve.Shelf.__init__(self, dict, protocol, writeback, keyencoding)
+        self.codec = codec
+        self.adaptive = adaptive
+
+    def __getitem__(self, key):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            value = pickle.loads(decode_frame(self.dict[key.encode(self.keyencoding)]))
+            if self.writeback:
+                self.cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if self.writeback:
+            self.cache[key] = value
+        payload = pickle.dumps(value, self._protocol)
+        self.dict[key.encode(self.keyencoding)] = encode_frame(payload, self.codec, self.adaptive)
+
+
+def open_compressed(filename, flag="c", codec="zlib", adaptive=True, protocol=None, writeback=False):
+    return CompressedShelf(dbm.open(filename, flag), codec, adaptive, protocol, writeback)
+
+
+def benchmark(payloads, repeat=3):
+    """Report the size/throughput tradeoff of every codec for a list of byte payloads."""
+    raw_size = sum(len(p) for p in payloads)
+    results = {}
+    for codec in CODECS:
+        best_encode = best_decode = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frames = [encode_frame(p, codec, adaptive=False) for p in payloads]
+            best_encode = min(best_encode, time.perf_counter() - start)
+            start = time.perf_counter()
+            for frame in frames:
+                decode_frame(frame)
+            best_decode = min(best_decode, time.perf_counter() - start)
+        size = sum(len(f) for f in frames)
+        results[codec] = {
+            "size": size,
+            "ratio": size / raw_size,
+            "encode_mb_s": raw_size / best_encode / 1e6,
+            "decode_mb_s": raw_size / best_decode / 1e6,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    a_dict = dict()
+    a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+    a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+    a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+    a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    a_list = ["a", 123, [10, 100, 1000]]
+
+    with FramedWriter("multidata.pckz", codec="zlib") as file_out:
+        for i in range(1000):
+            file_out.dump(a_dict if i % 2 else a_list)
+
+    with FramedReader("multidata.pckz") as file_in:
+        print("Records:", len(file_in), "codec:", file_in.codec)
+        print("Record 999:", file_in[999])
+
+    with open_compressed("compressed_shelve.shlv", codec="lzma") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["TABLE"] = [dict(a_dict) for _ in range(50)]
+        print(my_shelve["EUR"], len(my_shelve["TABLE"]))
+
+    payloads = [
+        pickle.dumps({"{}{}".format(code, i): dict(entry) for i in range(n) for code, entry in a_dict.items()})
+        for n in (1, 10, 100, 1000)
+    ]
+    print("{:>6} {:>10} {:>7} {:>12} {:>12}".format("codec", "size", "ratio", "enc MB/s", "dec MB/s"))
+    for codec, row in benchmark(payloads).items():
+        print("{:>6} {:>10} {:>7.3f} {:>12.1f} {:>12.1f}".format(codec, row["size"], row["ratio"], row["encode_mb_s"], row["decode_mb_s"]))
@@ -0,0 +1,292 @@
+"""
+Deduplicating pickles across dump() calls
+Within a single pickle.dump() call the pickle 'memo' makes sure that an object referenced twice is stored once. But the memo is forgotten as soon as dump() returns: when you dump a_dict into a file ten times (think of snapshots taken every minute), its nested currency dictionaries are stored ten times in full.
+
+A content-addressed container fixes that:
+
+every sub-object (dict, list, tuple, set) is pickled on its own, and the result is hashed;
+a blob is identified by its hash (its 'content address'), so identical sub-objects produce identical addresses;
+each unique blob is written to the file only once, and the object that contained it stores just the address.
+
+The pickle module supports this directly through 'persistent IDs': when Pickler.persistent_id() returns something other than None, pickle stores that value instead of the object, and Unpickler.persistent_load() is asked to turn it back into an object when loading.
+
+Sub-objects whose pickled form is shorter than a threshold are kept inline, because an address (16 bytes) plus the bookkeeping would cost more than it saves.
+
+A sub-object that is part of a cycle (a list containing itself, a dict pointing back to its parent...) can't be a blob of its own: loading a blob creates a fresh object, so the cycle would lead back to a copy. The objects of a cycle, and the objects containing them, are therefore kept inline, so that the whole cycle ends up in one pickle, where the memo turns the back-reference into a reference as a plain pickle.dump() would. They aren't deduplicated (their other sub-objects still are).
+
+Loading a blob creates a fresh object, so the same goes for an object referenced more than once within one dump(): when a first attempt finds such objects, the dump is done again with them (and the objects containing them) inline, and the memo keeps them shared as pickle.dump() would. Between different dump() calls, deduplication is done by value, not by identity: two equal dictionaries become one blob, but every record loads its own fresh copy.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import hashlib
+import io
+import pickle
+import struct
+from collections import Counter
+
+CONTAINERS = (dict, list, tuple, set, frozenset)
+
+ENTRY = struct.Struct("<cI")
+BLOB = b"B"
+RECORD = b"R"
+DIGEST_SIZE = 16
+
+
+class _Cycle(Exception):
+    """Raised by _intern() for an object that must be pickled inline because it's part of a cycle."""
+
+
+# markers in DedupWriter._seen
+_PENDING = object()
+_CYCLIC = object()
+
+
+class _DedupPickler(pickle.Pickler):
+    def __init__(self, file, container, root):
+        pickle.Pickler.__init__(self, file, container.protocol)
+        self.container = container
+        self.root = root
+        self.expanded = 0
+        self.cyclic = False
+        self.references = []
+
+    def persistent_id(self, obj):
+        if obj is self.root or type(obj) not in CONTAINERS:
+            return None
+        if obj:
+            self.references.append(id(obj))
+        try:
+            digest, expanded = self.container._intern(obj)
+        except _Cycle:
+            if self.container._seen[id(obj)][1] is _PENDING:
+                # obj itself is still being pickled, further up: let that pickle hold the cycle
+                raise
+            # pickled inline: if the cycle leads back to our root, our memo closes it, otherwise
+            # we meet the pending object again and pass the exception on
+            self.cyclic = True
+            return None
+        if digest is not None:
+            self.expanded += expanded
+        return digest
+
+
+class DedupWriter:
+    """Appends objects to a container file, storing each large enough sub-object only once."""
+
+    def __init__(self, filename, threshold=64, protocol=pickle.HIGHEST_PROTOCOL):
+        self.threshold = threshold
+        self.protocol = protocol
+        self.digests = set(_scan(filename)[0]) if _exists(filename) else set()
+        self.file = open(filename, "ab")
+        self.logical_bytes = 0
+        self.physical_bytes = 0
+        self._seen = {}
+        self._shared = set()
+        self._references = Counter()
+        self._blobs = {}
+
+    def _write(self, tag, payload):
+        self.file.write(ENTRY.pack(tag, len(payload)))
+        self.file.write(payload)
+        self.physical_bytes += ENTRY.size + len(payload)
+
+    def _intern(self, obj):
+        try:
+            seen = self._seen[id(obj)]
+        except KeyError:
+            pass
+        else:
+            if seen[1] is _PENDING or seen[1] is _CYCLIC:
+                raise _Cycle
+            return seen[1:]
+        if id(obj) in self._shared:
+            # referenced more than once: pickled inline like a cycle, so one memo sees every reference
+            self._seen[id(obj)] = (obj, _CYCLIC, 0)
+            raise _Cycle
+        self._seen[id(obj)] = (obj, _PENDING, 0)
+        buffer = io.BytesIO()
+        pickler = _DedupPickler(buffer, self, obj)
+        try:
+            pickler.dump(obj)
+        except _Cycle:
+            self._seen[id(obj)] = (obj, _CYCLIC, 0)
+            raise
+        if pickler.cyclic:
+            self._seen[id(obj)] = (obj, _CYCLIC, 0)
+            raise _Cycle
+        blob = buffer.getvalue()
+        if len(blob) < self.threshold:
+            result = None, 0
+        else:
+            digest = hashlib.blake2b(blob, digest_size=DIGEST_SIZE).digest()
+            if digest not in self.digests:
+                self._blobs[digest] = blob
+            result = digest, len(blob) + pickler.expanded
+            # only the references of a pickle that is kept count: an inline object is pickled again
+            self._references.update(pickler.references)
+        # keep obj alive so that its id() isn't reused during this dump
+        self._seen[id(obj)] = (obj,) + result
+        return result
+
+    def _dump_once(self, obj):
+        buffer = io.BytesIO()
+        pickler = _DedupPickler(buffer, self, obj)
+        self._seen[id(obj)] = (obj, _PENDING, 0)
+        try:
+            pickler.dump(obj)
+        finally:
+            self._seen.clear()
+        self._references.update(pickler.references)
+        return buffer.getvalue(), pickler
+
+    def dump(self, obj):
+        try:
+            while True:
+                record, pickler = self._dump_once(obj)
+                shared = {key for key, count in self._references.items() if count > 1} - self._shared
+                if not shared:
+                    break
+                # two blobs referring to one object would each load a copy of it: start again with
+                # these objects inline
+                self._shared |= shared
+                self._references.clear()
+                self._blobs.clear()
+            for digest, blob in self._blobs.items():
+                self.digests.add(digest)
+                self._write(BLOB, digest + blob)
+        finally:
+            self._shared.clear()
+            self._references.clear()
+            self._blobs.clear()
+        self._write(RECORD, record)
+        self.logical_bytes += len(record) + pickler.expanded
+
+    @property
+    def dedup_ratio(self):
+        """How many times bigger the file would be if every reference was replaced by a copy of its blob."""
+        return self.logical_bytes / self.physical_bytes if self.physical_bytes else 1.0
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _exists(filename):
+    try:
+        with open(filename, "rb"):
+            return True
+    except FileNotFoundError:
+        return False
+
+
+def _scan(filename):
+    blobs = {}
+    records = []
+    with open(filename, "rb") as file_in:
+        while True:
+            header = file_in.read(ENTRY.size)
+            if len(header) < ENTRY.size:
+                break
+            tag, length = ENTRY.unpack(header)
+            offset = file_in.tell()
+            if tag == BLOB:
+                blobs[file_in.read(DIGEST_SIZE)] = (offset + DIGEST_SIZE, length - DIGEST_SIZE)
+                file_in.seek(offset + length)
+            else:
+                records.append((offset, length))
+                file_in.seek(length, io.SEEK_CUR)
+    return blobs, records
+
+
+class _DedupUnpickler(pickle.Unpickler):
+    def __init__(self, data, reader):
+        pickle.Unpickler.__init__(self, io.BytesIO(data))
+        self.reader = reader
+
+    def persistent_load(self, digest):
+        return _DedupUnpickler(self.reader._read(*self.reader.blobs[digest]), self.reader).load()
+
+
+class DedupReader:
+    """Loads the objects stored by DedupWriter, in order or by position."""
+
+    def __init__(self, filename):
+        self.blobs, self.records = _scan(filename)
+        self.file = open(filename, "rb")
+
+    def _read(self, offset, length):
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return _DedupUnpickler(self._read(*self.records[index]), self).load()
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    import os
+
+    a_dict = dict()
+    a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+    a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+    a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+    a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    a_list = ["a", 123, [10, 100, 1000]]
+
+    if os.path.exists("snapshots.pckd"):
+        os.remove("snapshots.pckd")
+
+    with DedupWriter("snapshots.pckd", threshold=32) as file_out:
+        for minute in range(100):
+            # every snapshot is a fresh copy, so the pickle memo couldn't help here
+            snapshot = {"minute": minute, "rates": {code: dict(entry) for code, entry in a_dict.items()}, "list": list(a_list)}
+            file_out.dump(snapshot)
+        print("logical bytes:", file_out.logical_bytes)
+        print("physical bytes:", file_out.physical_bytes)
+        print("dedup ratio: {:.2f}".format(file_out.dedup_ratio))
+
+    with DedupReader("snapshots.pckd") as file_in:
+        print(len(file_in), "snapshots")
+        print(file_in[42])
+
+    a_list.append(a_list)
+    node = {"rates": a_dict}
+    node["self"] = {"parent": node, "padding": list(range(20))}
+    if os.path.exists("cycles.pckd"):
+        os.remove("cycles.pckd")
+    with DedupWriter("cycles.pckd", threshold=8) as file_out:
+        file_out.dump([a_list, node])
+    with DedupReader("cycles.pckd") as file_in:
+        restored_list, restored_node = file_in[0]
+    assert restored_list[3] is restored_list and restored_node["self"]["parent"] is restored_node
+    os.remove("cycles.pckd")
+
+    shared = list(range(40))
+    with DedupWriter("cycles.pckd", threshold=8) as file_out:
+        file_out.dump([shared, shared, {"first": [shared, 1], "second": [shared, 2]}])
+    with DedupReader("cycles.pckd") as file_in:
+        restored = file_in[0]
+    assert restored[0] is restored[1] is restored[2]["first"][0] is restored[2]["second"][0]
+    os.remove("cycles.pckd")
@@ -0,0 +1,247 @@
+"""
+Frozen shelves: read-only snapshots with a perfect hash index
+Reference data like the currency table of shelve_module.py is written once and then read millions of times, often by many processes. A dbm database is built for changes: dbm.dumb parses its whole '.dir' file when it's opened and opens the '.dat' file again for every lookup.
+
+freeze(shelf, path) writes the items of a shelf (or of any mapping) into a single file that never changes, and FrozenShelf reads it with mmap. The keys are stored encoded with the keyencoding given to freeze() (utf-8 by default, whatever the shelf used), and FrozenShelf must be given the same one.
+
+header        b"FRZSHLV1", number of keys n, number of buckets, salt
+displacements one 32-bit integer per bucket
+slots         n x (offset, key length, value length)
+data          the keys and the pickled values
+
+The index is a minimal perfect hash: a function mapping each of the n keys to a different slot between 0 and n - 1, with no empty slots and no collisions, so a lookup is always a single probe. It's built with the 'hash and displace' method: a blake2b digest of the key (with a salt) gives three numbers h0, h1, h2; h0 picks a bucket, and each bucket gets a displacement d, found by trial at freeze time, such that
+
+slot = (h1 + d * h2) % n
+
+is a free slot for every key of the bucket. Buckets with a single key are simply given one of the slots left over, stored as -slot - 1. The key is stored next to its value, so a key that isn't in the snapshot - which also hashes to some slot - is recognized as missing.
+
+Opening the file only maps it into memory and reads the header, so it's instant whatever the size. Nothing is ever written, so no locks are needed, and since mmap reads go through the operating system's page cache, any number of processes reading the same file share a single copy of it in memory. Values are unpickled straight from the mapped pages.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import hashlib
+import mmap
+import os
+import pickle
+import shelve
+import struct
+from array import array
+
+MAGIC = b"FRZSHLV1"
+HEADER = struct.Struct("<8sQQ16s")
+SLOT = struct.Struct("<QII")
+HASH = struct.Struct("<QQQ")
+MAX_DISPLACEMENT = 100000
+
+
+def _hashes(key, salt):
+    return HASH.unpack(hashlib.blake2b(key, digest_size=HASH.size, salt=salt).digest())
+
+
+def _build(hashes):
+    """Returns (displacements, slot -> key number) for the key hashes, or None if some bucket can't be placed."""
+    n = len(hashes)
+    bucket_count = max(1, n)
+    buckets = [[] for _ in range(bucket_count)]
+    for number, (h0, h1, h2) in enumerate(hashes):
+        buckets[h0 % bucket_count].append(number)
+    displacements = array("i", bytes(4 * bucket_count))
+    slots = [-1] * n
+    order = sorted(range(bucket_count), key=lambda bucket: len(buckets[bucket]), reverse=True)
+    position = 0
+    for position, bucket in enumerate(order):
+        members = buckets[bucket]
+        if len(members) <= 1:
+            break
+        for d in range(MAX_DISPLACEMENT):
+            chosen = []
+            for number in members:
+                h0, h1, h2 = hashes[number]
+                slot = (h1 + d * (h2 % (n - 1) + 1)) % n
+                if slots[slot] != -1 or slot in chosen:
+                    break
+                chosen.append(slot)
+            else:
+                for number, slot in zip(members, chosen):
+                    slots[slot] = number
+                displacements[bucket] = d
+                break
+        else:
+            return None
+    else:
+        position = len(order)
+    free = [slot for slot in range(n) if slots[slot] == -1]
+    for bucket in order[position:]:
+        if buckets[bucket]:
+            slot = free.pop()
+            slots[slot] = buckets[bucket][0]
+            displacements[bucket] = -slot - 1
+    return displacements, slots
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _items(shelf, keyencoding):
+    """Yields (key bytes, pickled value) pairs, reusing the stored pickles of a shelf."""
+    if isinstance(shelf, shelve.Shelf) and not shelf.writeback:
+        for key in shelf.dict.keys():
+            data = shelf.dict[key]
+            if shelf.keyencoding != keyencoding:
+                key = key.decode(shelf.keyencoding).encode(keyencoding)
+            yield key, data
+    else:
+        for key, value in shelf.items():
+            yield key.encode(keyencoding), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def freeze(shelf, path, keyencoding="utf-8"):
+    """Writes the items of shelf into an immutable file readable by FrozenShelf(path, keyencoding)."""
+    items = list(_items(shelf, keyencoding))
+    n = len(items)
+    salt_count = 0
+    while True:
+        salt = salt_count.to_bytes(16, "little")
+        hashes = [_hashes(key, salt) for key, data in items]
+        built = _build(hashes) if n else (array("i", [0]), [])
+        if built is not None:
+            break
+        salt_count += 1
+    displacements, slots = built
+    table_start = HEADER.size + _padding(HEADER.size + 4 * len(displacements)) + 4 * len(displacements)
+    offset = table_start + SLOT.size * n
+    table = bytearray()
+    for number in slots:
+        key, data = items[number]
+        table += SLOT.pack(offset, len(key), len(data))
+        offset += len(key) + len(data)
+    with open(path + ".tmp", "wb") as file_out:
+        file_out.write(HEADER.pack(MAGIC, n, len(displacements), salt))
+        file_out.write(displacements.tobytes())
+        file_out.write(b"\0" * _padding(HEADER.size + 4 * len(displacements)))
+        file_out.write(table)
+        for number in slots:
+            key, data = items[number]
+            file_out.write(key)
+            file_out.write(data)
+    os.replace(path + ".tmp", path)
+    return n
+
+
+class FrozenShelf:
+    def __init__(self, path, keyencoding="utf-8"):
+        self.keyencoding = keyencoding
+        with open(path, "rb") as file_in:
+            if os.fstat(file_in.fileno()).st_size < HEADER.size:
+                raise ValueError("{!r} is not a frozen shelf".format(path))
+            self._map = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, bucket_count, self._salt = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            self._map = None
+            raise ValueError("{!r} is not a frozen shelf".format(path))
+        self._view = memoryview(self._map)
+        end = HEADER.size + 4 * bucket_count
+        self._displacements = self._view[HEADER.size:end].cast("i")
+        self._table = end + _padding(end)
+
+    def _slot(self, key):
+        n = self._count
+        if not n:
+            return None
+        h0, h1, h2 = _hashes(key, self._salt)
+        d = self._displacements[h0 % len(self._displacements)]
+        slot = -d - 1 if d < 0 else (h1 + d * (h2 % (n - 1) + 1)) % n
+        offset, key_length, value_length = SLOT.unpack_from(self._map, self._table + SLOT.size * slot)
+        if self._view[offset:offset + key_length] != key:
+            return None
+        return offset + key_length, value_length
+
+    def __getitem__(self, key):
+        found = self._slot(key.encode(self.keyencoding))
+        if found is None:
+            raise KeyError(key)
+        offset, length = found
+        return pickle.loads(self._view[offset:offset + length])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._slot(key.encode(self.keyencoding)) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for slot in range(self._count):
+            offset, key_length, value_length = SLOT.unpack_from(self._map, self._table + SLOT.size * slot)
+            yield bytes(self._view[offset:offset + key_length]).decode(self.keyencoding)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def close(self):
+        if self._map is not None:
+            self._displacements.release()
+            self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_frozen(path, keyencoding="utf-8"):
+    return FrozenShelf(path, keyencoding)
+
+
+if __name__ == "__main__":
+    import glob
+    import time
+
+    shelve_name = "first_shelve.shlv"
+
+    with shelve.open(shelve_name, flag="n") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+        freeze(my_shelve, "currencies.frozen")
+
+    with open_frozen("currencies.frozen") as currencies:
+        print(len(currencies), sorted(currencies), currencies["USD"], "XYZ" in currencies)
+
+    N = 200000
+    with shelve.open("test_frozen", flag="n") as shelf:
+        for i in range(N):
+            shelf["key{}".format(i)] = {"id": i, "code": "Euro", "symbol": "€"}
+        start = time.perf_counter()
+        freeze(shelf, "test.frozen")
+        print("froze {} keys in {:.2f} s, {} bytes".format(N, time.perf_counter() - start, os.path.getsize("test.frozen")))
+
+    keys = ["key{}".format(i) for i in range(0, N, 7)]
+    for name, opener in (("dbm.dumb shelf", lambda: shelve.open("test_frozen", flag="r")), ("frozen shelf", lambda: open_frozen("test.frozen"))):
+        start = time.perf_counter()
+        with opener() as shelf:
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for key in keys:
+                shelf[key]
+            lookups = len(keys) / (time.perf_counter() - start)
+        print("{}: open {:.4f} s, {:.0f} lookups/s".format(name, opened, lookups))
+
+    for path in glob.glob("test_frozen*") + ["test.frozen"]:
+        os.remove(path)
@@ -0,0 +1,199 @@
+"""
+Pickling functions by value
+As the function.pckl example in serialization.py shows, pickle stores a function by its name only. The receiving side must be able to import it, so a function defined in __main__, a lambda or a nested function can't be sent to another process.
+
+A function object is, however, made of a few parts that can be serialized on their own:
+
+the code object (bytecode, constants, names) - the marshal module can turn it into bytes;
+the default values of its parameters (__defaults__ and __kwdefaults__);
+the closure - the cells holding variables captured from the enclosing function;
+the globals it references - only the names that appear in the code (co_names), not the whole module namespace.
+
+The FunctionPickler below uses the reducer_override() hook of the pickle.Pickler class: functions that can't be imported by name are replaced by a 'skeleton' built from the marshalled code, and everything else (defaults, closure, globals) is restored afterwards as the object's state. Because pickle memoizes the skeleton before it pickles the state, recursive and mutually recursive functions work too.
+
+Remember that marshal data is tied to the Python version, so both sides must run the same interpreter.
+
+Encoding a function costs much more than a name lookup, so the encoded form is cached per function object and pickle protocol. Dispatching the same function to a pool of workers again and again costs a dictionary lookup on the sending side and on the receiving side.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import functools
+import importlib
+import io
+import marshal
+import pickle
+import sys
+import types
+import weakref
+
+_cache = weakref.WeakKeyDictionary()
+
+
+def _is_importable(func):
+    module = sys.modules.get(func.__module__)
+    if module is None or func.__module__ == "__main__":
+        return False
+    obj = module
+    for part in func.__qualname__.split("."):
+        obj = getattr(obj, part, None)
+    return obj is func
+
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+def _make_skeleton(code_bytes, name, cell_count):
+    code = marshal.loads(code_bytes)
+    closure = tuple(types.CellType() for _ in range(cell_count)) or None
+    return types.FunctionType(code, {"__builtins__": __builtins__}, name, None, closure)
+
+
+def _set_function_state(func, state):
+    func.__globals__.update(state["globals"])
+    func.__defaults__ = state["defaults"]
+    func.__kwdefaults__ = state["kwdefaults"]
+    func.__qualname__ = state["qualname"]
+    func.__module__ = state["module"]
+    func.__dict__.update(state["dict"])
+    for cell, value in zip(func.__closure__ or (), state["closure"]):
+        if value is not _EMPTY:
+            cell.cell_contents = value
+    return func
+
+
+class _Empty:
+    def __reduce__(self):
+        return "_EMPTY"
+
+
+_EMPTY = _Empty()
+
+
+class FunctionPickler(pickle.Pickler):
+    """A Pickler which stores non-importable functions by value."""
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        if not isinstance(obj, types.FunctionType) or _is_importable(obj):
+            return NotImplemented
+        if obj is _make_skeleton or obj is _set_function_state:
+            # our own helpers, even when this file runs as __main__
+            return NotImplemented
+        # the receiving side imports the helpers by name, so refer to them through the module
+        # even when this file runs as __main__
+        helpers = importlib.import_module("function_serialization")
+        code = obj.__code__
+        closure = []
+        for cell in obj.__closure__ or ():
+            try:
+                closure.append(cell.cell_contents)
+            except ValueError:
+                closure.append(helpers._EMPTY)
+        state = {
+            "globals": {
+                name: obj.__globals__[name]
+                for name in _referenced_names(code)
+                if name in obj.__globals__
+            },
+            "defaults": obj.__defaults__,
+            "kwdefaults": obj.__kwdefaults__,
+            "qualname": obj.__qualname__,
+            "module": obj.__module__,
+            "dict": obj.__dict__,
+            "closure": closure,
+        }
+        args = (marshal.dumps(code), obj.__name__, len(closure))
+        return helpers._make_skeleton, args, state, None, None, helpers._set_function_state
+
+
+def dumps(obj, protocol=None):
+    buffer = io.BytesIO()
+    FunctionPickler(buffer, protocol).dump(obj)
+    return buffer.getvalue()
+
+
+loads = pickle.loads
+
+
+def dumps_function(func, protocol=None):
+    """Like dumps(), but the result is cached per function object and protocol."""
+    encoded = _cache.setdefault(func, {})
+    try:
+        return encoded[protocol]
+    except KeyError:
+        data = encoded[protocol] = dumps(func, protocol)
+        return data
+
+
+def forget(func=None):
+    """Drop a function (or all functions) from the encoding cache, e.g. after changing its defaults."""
+    if func is None:
+        _cache.clear()
+    else:
+        _cache.pop(func, None)
+
+
+@functools.lru_cache(maxsize=256)
+def loads_function(data):
+    return pickle.loads(data)
+
+
+def run_serialized(data, args=(), kwargs=None):
+    """Executed in the worker: decode (or fetch from cache) the function and call it."""
+    return loads_function(data)(*args, **(kwargs or {}))
+
+
+def submit(executor, func, *args, **kwargs):
+    """executor.submit() for functions the workers can't import."""
+    return executor.submit(run_serialized, dumps_function(func), args, kwargs)
+
+
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    def f1():
+        a = 5
+        print(a)
+        print("Hello from the jar!")
+
+    with open("function_by_value.pckl", "wb") as file_out:
+        file_out.write(dumps(f1))
+
+    with open("function_by_value.pckl", "rb") as file_in:
+        data = loads(file_in.read())
+
+    print(type(data))
+    print(data)
+    data()
+
+    def make_multiplier(factor):
+        return lambda x, offset=0: x * factor + offset
+
+    triple = make_multiplier(3)
+    print(loads(dumps(triple))(5, offset=1))
+
+    def fact(n):
+        return 1 if n <= 1 else n * fact(n - 1)
+
+    print(loads(dumps(fact))(10))
+
+    start = time.perf_counter()
+    for _ in range(10000):
+        dumps(triple)
+    print("uncached encode: {:.2f} us".format((time.perf_counter() - start) / 10000 * 1e6))
+    start = time.perf_counter()
+    for _ in range(10000):
+        dumps_function(triple)
+    print("cached encode:   {:.2f} us".format((time.perf_counter() - start) / 10000 * 1e6))
+
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        futures = [submit(pool, triple, i, offset=1) for i in range(10)]
+        print([future.result() for future in futures])
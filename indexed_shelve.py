@@ -0,0 +1,204 @@
+"""
+Secondary indexes for shelves
+A shelf answers one question quickly: 'what is stored under this key?'. In shelve_module.py the keys are currency codes and the values are dictionaries like {"code": "Euro", "symbol": "€"}. Asking 'which currency uses the symbol "$"?' means unpickling every single value and looking inside.
+
+Databases answer such questions with secondary indexes, and a shelf can have them too. An index maps the value of a field (or of any function of the stored value) to the set of keys whose values have it:
+
+index "symbol":  "€" -> {"EUR"},  "$" -> {"USD"},  ...
+
+IndexedShelf keeps its indexes up to date on every assignment and deletion, so find(symbol="$") is a dictionary lookup followed by loading just the matching values. A second, reverse mapping (key -> indexed value) lets an assignment remove the key from its old index entry without unpickling the old value.
+
+The indexes are pickled into a '.idx' file next to the shelf when it is synced or closed. The file is deleted at the first modification after opening, so if the program crashes before the next sync() the missing file makes the next open() rebuild the indexes from the data instead of trusting stale ones. Opening with flag "n" empties the database, so an existing '.idx' file is simply deleted.
+
+Each index is saved with a signature of its function - None for a field index, otherwise the name and a hash of the compiled code of the function. An index whose function has changed since it was saved is rebuilt from the data instead of being loaded. The file also records the sizes and modification times of the database files: if they differ when the shelf is opened, the database was changed by something else (a plain shelve.open(), say) and every index is rebuilt.
+
+The indexed values are computed before a value is stored, so a function that fails, or returns an unhashable value, raises before the database or the indexes are touched.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import hashlib
+import marshal
+import os
+import pickle
+import shelve
+
+_MISSING = object()
+
+
+def _field_getter(field):
+    def get(value):
+        if isinstance(value, dict):
+            return value.get(field, _MISSING)
+        return getattr(value, field, _MISSING)
+
+    return get
+
+
+def _signature(function):
+    """Identifies an index function, so an index built by a different function isn't reused."""
+    if function is None:
+        return None
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return repr(function)
+    return function.__qualname__, hashlib.blake2b(marshal.dumps(code), digest_size=16).hexdigest()
+
+
+def _dbm_signature(filename):
+    """Sizes and modification times of the database files, whichever dbm module made them."""
+    signature = []
+    for suffix in ("", ".dat", ".dir", ".db", ".pag"):
+        try:
+            stat = os.stat(filename + suffix)
+        except FileNotFoundError:
+            continue
+        signature.append((suffix, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+class IndexedShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, indexes=None):
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        self.filename = filename
+        self.index_path = filename + ".idx"
+        self.functions = {}
+        self.signatures = {}
+        self.indexes = {}
+        self.reverse = {}
+        self._saved = False
+        if flag == "n":
+            # the database was just emptied: whatever is in the file describes an older one
+            stored = {}
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+        else:
+            stored = self._load_indexes()
+        for name, function in (indexes or {}).items():
+            self.add_index(name, function, _stored=stored.get(name))
+
+    def _load_indexes(self):
+        try:
+            with open(self.index_path, "rb") as file_in:
+                signature, stored = pickle.load(file_in)
+        except FileNotFoundError:
+            return {}
+        if signature != _dbm_signature(self.filename):
+            # the database was changed without us, e.g. through shelve.open()
+            return {}
+        self._saved = True
+        return stored
+
+    def add_index(self, name, function=None, _stored=None):
+        """Indexes the values by function(value), or by the field called name if function is None."""
+        self.functions[name] = function or _field_getter(name)
+        self.signatures[name] = _signature(function)
+        if _stored is not None and _stored[0] == self.signatures[name]:
+            self.indexes[name], self.reverse[name] = _stored[1:]
+            return
+        self.indexes[name] = {}
+        self.reverse[name] = {}
+        for key in self:
+            self._add(name, key, self._indexed(name, self[key]))
+        self._unsave()
+
+    def _indexed(self, name, value):
+        indexed = self.functions[name](value)
+        if indexed is not _MISSING:
+            hash(indexed)  # an unhashable value fails here, before anything is changed
+        return indexed
+
+    def _add(self, name, key, indexed):
+        if indexed is _MISSING:
+            return
+        self.indexes[name].setdefault(indexed, set()).add(key)
+        self.reverse[name][key] = indexed
+
+    def _remove(self, name, key):
+        indexed = self.reverse[name].pop(key, _MISSING)
+        if indexed is _MISSING:
+            return
+        keys = self.indexes[name][indexed]
+        keys.discard(key)
+        if not keys:
+            del self.indexes[name][indexed]
+
+    def _unsave(self):
+        if self._saved:
+            try:
+                os.remove(self.index_path)
+            except FileNotFoundError:
+                pass
+            self._saved = False
+
+    def __setitem__(self, key, value):
+        entries = {name: self._indexed(name, value) for name in self.functions}
+        self._unsave()
+        shelve.Shelf.__setitem__(self, key, value)
+        for name, indexed in entries.items():
+            self._remove(name, key)
+            self._add(name, key, indexed)
+
+    def __delitem__(self, key):
+        self._unsave()
+        shelve.Shelf.__delitem__(self, key)
+        for name in self.functions:
+            self._remove(name, key)
+
+    def find_keys(self, **criteria):
+        """The keys whose values match all the criteria, e.g. find_keys(symbol="$")."""
+        result = None
+        for name, indexed in criteria.items():
+            if name not in self.indexes:
+                raise KeyError("no index named {!r}".format(name))
+            keys = self.indexes[name].get(indexed, set())
+            result = set(keys) if result is None else result & keys
+        return result if result is not None else set(self)
+
+    def find(self, **criteria):
+        """Like find_keys(), but returns a {key: value} dictionary."""
+        return {key: self[key] for key in self.find_keys(**criteria)}
+
+    def sync(self):
+        shelve.Shelf.sync(self)
+        if isinstance(self.dict, shelve._ClosedDict) or self._saved:
+            return
+        stored = {name: (self.signatures[name], self.indexes[name], self.reverse[name]) for name in self.indexes}
+        with open(self.index_path + ".tmp", "wb") as file_out:
+            pickle.dump((_dbm_signature(self.filename), stored), file_out, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self._saved = True
+
+
+def open_indexed(filename, flag="c", protocol=None, indexes=None):
+    return IndexedShelf(filename, flag, protocol, indexes)
+
+
+if __name__ == "__main__":
+    import time
+
+    shelve_name = "first_shelve.shlv"
+
+    with open_indexed(shelve_name, flag="n", indexes={"symbol": None, "length": lambda value: len(value["code"])}) as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+        my_shelve["CAD"] = {"code": "Canadian dollar", "symbol": "$"}
+        print(my_shelve.find(symbol="$"))
+        print(my_shelve.find_keys(symbol="$", length=9))
+        del my_shelve["CAD"]
+
+    with open_indexed(shelve_name, indexes={"symbol": None}) as my_shelve:
+        print(my_shelve.find(symbol="$"))
+        for i in range(20000):
+            my_shelve["X{:05d}".format(i)] = {"code": "Currency {}".format(i), "symbol": "¤{}".format(i % 100)}
+
+        start = time.perf_counter()
+        found = [key for key in my_shelve if my_shelve[key]["symbol"] == "$"]
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        assert my_shelve.find_keys(symbol="$") == set(found)
+        lookup = time.perf_counter() - start
+        print("full scan {:.4f} s, index lookup {:.6f} s".format(scan, lookup))
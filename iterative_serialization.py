@@ -0,0 +1,285 @@
+"""
+Serializing very deep object graphs without recursion
+The notes in serialization.py warn that pickling a highly recursive data structure may exceed the maximum recursion depth and raise a RecursionError. A linked list of 10 000 nodes, or a list nested 1000 levels deep, is enough. Raising the limit with sys.setrecursionlimit() only moves the problem: past some depth the C stack itself overflows and the interpreter crashes.
+
+The pickler recurses because saving a container means saving its items first, and an item may be a container too. The same walk can be done with an explicit stack (a Python list) of 'things still to do' instead of the call stack: the depth of the graph then only costs memory.
+
+The output of the walker below is the ordinary pickle format (protocol 4), so there is no need for a special loader: the unpickler is a stack machine that reads one opcode at a time and doesn't recurse at all, so pickle.loads() reads any depth.
+
+How the walker handles the different objects:
+
+None, booleans, numbers, strings and bytes are written directly;
+lists, dicts and sets are created empty, remembered in the 'memo', and only then filled with their items - so a cycle leading back to them just refers to the memo;
+tuples and frozensets are immutable, so they are created after their items; when a cycle leads back to a tuple through a mutable object, a copy is built at that point and the outer one is replaced by a memo reference, exactly like pickle does it;
+instances of ordinary classes (no custom __reduce__, __reduce_ex__, __getstate__ or __new__) are created with cls.__new__(cls) and get their __dict__ afterwards (the class is referenced by name, as pickle always does);
+anything else is pickled with pickle.dumps() and embedded as a single value.
+
+The memo is keyed by id(), so an object referenced many times is stored once.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import io
+import pickle
+import struct
+import sys
+
+PROTOCOL = 4
+
+MARK = b"("
+STOP = b"."
+NONE = b"N"
+NEWTRUE = b"\x88"
+NEWFALSE = b"\x89"
+BININT = b"J"
+LONG1 = b"\x8a"
+BINFLOAT = b"G"
+SHORT_BINUNICODE = b"\x8c"
+BINUNICODE8 = b"\x8d"
+SHORT_BINBYTES = b"C"
+BINBYTES8 = b"\x8e"
+EMPTY_LIST = b"]"
+APPENDS = b"e"
+EMPTY_DICT = b"}"
+SETITEMS = b"u"
+EMPTY_SET = b"\x8f"
+ADDITEMS = b"\x90"
+FROZENSET = b"\x91"
+EMPTY_TUPLE = b")"
+TUPLE = b"t"
+TUPLE1 = b"\x85"
+STACK_GLOBAL = b"\x93"
+NEWOBJ = b"\x81"
+REDUCE = b"R"
+BUILD = b"b"
+MEMOIZE = b"\x94"
+BINGET = b"h"
+LONG_BINGET = b"j"
+POP_MARK = b"1"
+
+_OBJECT = 0
+_RAW = 1
+_TUPLE_END = 2
+
+
+def _plain_instance(obj):
+    cls = type(obj)
+    return (
+        hasattr(obj, "__dict__")
+        and cls.__reduce_ex__ is object.__reduce_ex__
+        and cls.__reduce__ is object.__reduce__
+        and cls.__getstate__ is object.__getstate__
+        and not hasattr(cls, "__getnewargs_ex__")
+        and not hasattr(cls, "__getnewargs__")
+        and cls.__new__ is object.__new__
+    )
+
+
+class IterativePickler:
+    """Writes protocol 4 pickles of arbitrarily deep object graphs."""
+
+    def __init__(self, file):
+        self.write = file.write
+        self.memo = {}
+        self.building = {}
+
+    def _str(self, text):
+        data = text.encode("utf-8", "surrogatepass")
+        if len(data) < 256:
+            self.write(SHORT_BINUNICODE + bytes([len(data)]) + data)
+        else:
+            self.write(BINUNICODE8 + struct.pack("<Q", len(data)) + data)
+
+    def _get(self, index):
+        if index < 256:
+            self.write(BINGET + bytes([index]))
+        else:
+            self.write(LONG_BINGET + struct.pack("<I", index))
+
+    def _memoize(self, obj):
+        self.memo[id(obj)] = (len(self.memo), obj)
+        self.write(MEMOIZE)
+
+    def _atom(self, obj):
+        """Writes obj if it is a simple value and returns True, otherwise returns False."""
+        kind = type(obj)
+        if obj is None:
+            self.write(NONE)
+        elif kind is bool:
+            self.write(NEWTRUE if obj else NEWFALSE)
+        elif kind is int:
+            if -0x80000000 <= obj <= 0x7FFFFFFF:
+                self.write(BININT + struct.pack("<i", obj))
+            else:
+                data = pickle.encode_long(obj)
+                if len(data) > 255:
+                    return False
+                self.write(LONG1 + bytes([len(data)]) + data)
+        elif kind is float:
+            self.write(BINFLOAT + struct.pack(">d", obj))
+        elif kind is str:
+            self._str(obj)
+        elif kind is bytes:
+            if len(obj) < 256:
+                self.write(SHORT_BINBYTES + bytes([len(obj)]) + obj)
+            else:
+                self.write(BINBYTES8 + struct.pack("<Q", len(obj)) + obj)
+        else:
+            return False
+        return True
+
+    def _global(self, cls):
+        if id(cls) in self.memo:
+            self._get(self.memo[id(cls)][0])
+            return
+        self._str(cls.__module__)
+        self._str(cls.__qualname__)
+        self.write(STACK_GLOBAL)
+        self._memoize(cls)
+
+    def _end_tuple(self, item):
+        depth = self.building.pop(id(item))
+        if depth > 1:
+            self.building[id(item)] = depth - 1
+        if id(item) in self.memo:
+            self.write(POP_MARK)
+            self._get(self.memo[id(item)][0])
+        else:
+            self.write(TUPLE if type(item) is tuple else FROZENSET)
+            self._memoize(item)
+
+    def dump(self, obj):
+        self.write(b"\x80" + bytes([PROTOCOL]))
+        stack = [(_OBJECT, obj)]
+        while stack:
+            action, item = stack.pop()
+            if action == _RAW:
+                self.write(item)
+                continue
+            if action == _TUPLE_END:
+                self._end_tuple(item)
+                continue
+            if self._atom(item):
+                continue
+            if id(item) in self.memo:
+                self._get(self.memo[id(item)][0])
+                continue
+            kind = type(item)
+            if kind is list:
+                self.write(EMPTY_LIST)
+                self._memoize(item)
+                if item:
+                    self.write(MARK)
+                    stack.append((_RAW, APPENDS))
+                    stack.extend((_OBJECT, value) for value in reversed(item))
+            elif kind is dict:
+                self.write(EMPTY_DICT)
+                self._memoize(item)
+                if item:
+                    self.write(MARK)
+                    stack.append((_RAW, SETITEMS))
+                    for key, value in reversed(item.items()):
+                        stack.append((_OBJECT, value))
+                        stack.append((_OBJECT, key))
+            elif kind is set:
+                self.write(EMPTY_SET)
+                self._memoize(item)
+                if item:
+                    self.write(MARK)
+                    stack.append((_RAW, ADDITEMS))
+                    stack.extend((_OBJECT, value) for value in item)
+            elif kind is tuple or kind is frozenset:
+                if not item:
+                    self.write(EMPTY_TUPLE if kind is tuple else MARK + FROZENSET)
+                    self._memoize(item)
+                    continue
+                depth = self.building.get(id(item), 0)
+                if depth > 1:
+                    raise ValueError("can't serialize a cycle that goes only through tuples or frozensets")
+                # met again through a mutable object while its items are being written: build
+                # a second copy now, the outer one is then dropped in favour of the memo (like pickle does)
+                self.building[id(item)] = depth + 1
+                self.write(MARK)
+                stack.append((_TUPLE_END, item))
+                stack.extend((_OBJECT, value) for value in reversed(tuple(item)))
+            elif _plain_instance(item):
+                self._global(kind)
+                self.write(EMPTY_TUPLE + NEWOBJ)
+                self._memoize(item)
+                if item.__dict__:
+                    stack.append((_RAW, BUILD))
+                    stack.append((_OBJECT, item.__dict__))
+            else:
+                self._str("pickle")
+                self._str("loads")
+                self.write(STACK_GLOBAL)
+                self._atom(pickle.dumps(item, PROTOCOL))
+                self.write(TUPLE1 + REDUCE)
+                self._memoize(item)
+        self.write(STOP)
+
+
+def dumps(obj):
+    buffer = io.BytesIO()
+    IterativePickler(buffer).dump(obj)
+    return buffer.getvalue()
+
+
+def dump(obj, file):
+    IterativePickler(file).dump(obj)
+
+
+# the unpickler never recurses, so the standard functions load any depth
+loads = pickle.loads
+load = pickle.load
+
+
+class Node:
+    def __init__(self, value, next=None):
+        self.value = value
+        self.next = next
+
+
+if __name__ == "__main__":
+    import time
+
+    def nested_list(depth):
+        root = current = []
+        for _ in range(depth):
+            child = [1, "a"]
+            current.append(child)
+            current = child
+        return root
+
+    def linked_list(depth):
+        head = None
+        for value in range(depth):
+            head = Node(value, head)
+        return head
+
+    def timed(func, arg):
+        start = time.perf_counter()
+        result = func(arg)
+        return result, time.perf_counter() - start
+
+    print("{:<8} {:>9} {:>24} {:>24}".format("kind", "depth", "pickle dump/load (s)", "iterative dump/load (s)"))
+    for name, factory in (("list", nested_list), ("linked", linked_list)):
+        for depth in (10**2, 10**3, 10**4, 10**5, 10**6):
+            obj = factory(depth)
+            try:
+                data, dumped = timed(pickle.dumps, obj)
+                _, loaded = timed(pickle.loads, data)
+                plain = "{:>11.3f} {:>11.3f}".format(dumped, loaded)
+            except RecursionError:
+                plain = "{:>23}".format("RecursionError")
+            data, dumped = timed(dumps, obj)
+            restored, loaded = timed(loads, data)
+            print("{:<8} {:>9} {:>24} {:>12.3f} {:>11.3f}".format(name, depth, plain, dumped, loaded))
+
+    # cycles and shared references survive the round trip
+    a_list = ["a", 123, [10, 100, 1000]]
+    a_list.append(a_list)
+    shared = {"first": a_list[2], "second": a_list[2], "self": a_list}
+    restored = loads(dumps(shared))
+    print(restored["first"] is restored["second"], restored["self"][3] is restored["self"])
+    print(sys.getrecursionlimit(), "is still the recursion limit")
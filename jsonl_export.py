@@ -0,0 +1,182 @@
+"""
+Exporting pickled data as JSON Lines
+The notes at the end of serialization.py say it plainly: pickled data can't be exchanged with programs written in other languages, and JSON is the usual alternative. JSON Lines (JSONL) is JSON with one object per line, so a file can be written and read one record at a time, and tools in any language can stream it.
+
+export_jsonl(source, path) accepts either an iterable of objects or a multi-object pickle stream (a file name or a binary file object, like multidata.pckl) and writes one line per object. import_jsonl(path) is a generator yielding the objects back.
+
+Both work on batches of lines and never hold more than one batch in memory, so the size of the file doesn't matter.
+
+Most records are plain trees of dict, list, str, int, float, bool and None. For those the fast path is simply the C JSON encoder and decoder, without any Python callbacks. Only when the encoder meets something else (a TypeError), or the line contains the class marker, is the record walked in Python first, and on import only lines containing the class marker are decoded with an object hook.
+
+Custom classes like Cucumber are registered with register_class(). By default an instance is written as {"__class__": "module.Class", "state": {...its __dict__...}} and is rebuilt without calling __init__(), just like pickle does it; you can pass your own to_json/from_json functions instead. A dict of your own data that happens to contain the "__class__" key is escaped as {"__class__": null, "state": [[key, value], ...]}, so it comes back as the same dict.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import json
+import pickle
+
+CLASS_KEY = "__class__"
+BATCH_SIZE = 1000
+
+_to_json = {}
+_from_json = {}
+
+
+def _default_to_json(obj):
+    return vars(obj)
+
+
+def _default_from_json(cls):
+    def build(state):
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+
+    return build
+
+
+def register_class(cls, to_json=None, from_json=None, tag=None):
+    """Teaches the exporter how to write cls and the importer how to rebuild it."""
+    tag = tag or "{}.{}".format(cls.__module__, cls.__qualname__)
+    _to_json[cls] = (tag, to_json or _default_to_json)
+    _from_json[tag] = from_json or _default_from_json(cls)
+    return cls
+
+
+def _prepare(obj):
+    """Replaces registered objects by their tagged form, and escapes dicts that contain CLASS_KEY."""
+    kind = type(obj)
+    if kind is dict:
+        if CLASS_KEY in obj:
+            # a dict of the user's that would look like a tag: stored as a list of pairs under the None tag
+            return {CLASS_KEY: None, "state": [[key, _prepare(value)] for key, value in obj.items()]}
+        return {key: _prepare(value) for key, value in obj.items()}
+    if kind is list or kind is tuple:
+        return [_prepare(item) for item in obj]
+    if obj is None or kind in (str, int, float, bool):
+        return obj
+    try:
+        tag, to_json = _to_json[kind]
+    except KeyError:
+        raise TypeError("Object of type {} is not registered for JSON export".format(kind.__name__)) from None
+    return {CLASS_KEY: tag, "state": _prepare(to_json(obj))}
+
+
+def _object_hook(mapping):
+    if CLASS_KEY not in mapping or len(mapping) != 2 or "state" not in mapping:
+        return mapping
+    tag = mapping[CLASS_KEY]
+    if tag is None:
+        return dict(mapping["state"])
+    return _from_json[tag](mapping["state"])
+
+
+_fast_encode = json.JSONEncoder(ensure_ascii=False).encode
+_fast_decode = json.JSONDecoder().decode
+_slow_decode = json.JSONDecoder(object_hook=_object_hook).decode
+_MARKER = '"{}"'.format(CLASS_KEY)
+
+
+def encode(obj):
+    try:
+        line = _fast_encode(obj)
+    except TypeError:
+        line = None
+    if line is None or _MARKER in line:
+        # a registered object, or maybe a dict of the user's containing CLASS_KEY
+        line = _fast_encode(_prepare(obj))
+    return line
+
+
+def decode(line):
+    return _slow_decode(line) if _MARKER in line else _fast_decode(line)
+
+
+def iter_pickles(source):
+    """Yields the objects of a multi-object pickle stream, one at a time."""
+    if isinstance(source, str):
+        with open(source, "rb") as file_in:
+            yield from iter_pickles(file_in)
+        return
+    while True:
+        try:
+            yield pickle.load(source)
+        except EOFError:
+            return
+
+
+def export_jsonl(source, path, batch_size=BATCH_SIZE):
+    """Writes every object of source as a line of path and returns the number of lines."""
+    if isinstance(source, str) or hasattr(source, "read"):
+        source = iter_pickles(source)
+    count = 0
+    batch = []
+    with open(path, "w", encoding="utf-8") as file_out:
+        for obj in source:
+            batch.append(encode(obj))
+            if len(batch) >= batch_size:
+                file_out.write("\n".join(batch) + "\n")
+                count += len(batch)
+                batch = []
+        if batch:
+            file_out.write("\n".join(batch) + "\n")
+            count += len(batch)
+    return count
+
+
+def import_jsonl(path, batch_size=BATCH_SIZE):
+    with open(path, encoding="utf-8") as file_in:
+        while True:
+            lines = file_in.readlines(batch_size * 128)
+            if not lines:
+                return
+            for line in lines:
+                if line.strip():
+                    yield decode(line)
+
+
+class Cucumber:
+    def __init__(self):
+        self.size = "small"
+
+    def get_size(self):
+        return self.size
+
+
+register_class(Cucumber)
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    a_dict = dict()
+    a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+    a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+    a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+    a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    a_list = ["a", 123, [10, 100, 1000]]
+
+    with open("jsonl_multidata.pckl", "wb") as file_out:
+        pickle.dump(a_dict, file_out)
+        pickle.dump(a_list, file_out)
+        pickle.dump(Cucumber(), file_out)
+
+    print(export_jsonl("jsonl_multidata.pckl", "multidata.jsonl"), "lines written")
+    for obj in import_jsonl("multidata.jsonl"):
+        print(type(obj), obj if not isinstance(obj, Cucumber) else obj.get_size())
+
+    def records(n):
+        for i in range(n):
+            yield {"id": i, "rates": a_dict, "list": a_list} if i % 10 else {"id": i, "cucumber": Cucumber()}
+
+    start = time.perf_counter()
+    export_jsonl(records(500000), "big.jsonl")
+    exported = time.perf_counter() - start
+    start = time.perf_counter()
+    count = sum(1 for _ in import_jsonl("big.jsonl"))
+    print("500000 records: export {:.2f} s, import {:.2f} s ({} read back)".format(exported, time.perf_counter() - start, count))
+
+    os.remove("big.jsonl")
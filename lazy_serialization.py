@@ -0,0 +1,228 @@
+"""
+Lazy loading of large pickled trees
+In serialization.py the whole file is decoded by pickle.load(), even if you only need data1["USD"]. For a four-entry currency table that doesn't matter; for a snapshot of a few gigabytes it means minutes of decoding and gigabytes of memory to read a handful of fields.
+
+The format below stores a tree of dicts and lists so that every child has its own byte range in the file:
+
+a 'leaf' is an ordinary pickle (tag b"P" followed by the pickled bytes);
+a 'table' (tag b"D" for a dict, b"L" for a list) is made of its children, written one after another, followed by an array of their offsets, the pickled list of keys (for dicts) and a fixed-size trailer with the number of children and the size of the key list.
+
+Small containers (below a size threshold) are stored as a single leaf: splitting them would cost more than decoding them.
+
+Opening a file memory-maps it (mmap) and decodes only the root table's keys. The root comes back as a LazyDict or LazyList proxy: indexing it decodes just that child's byte range, and the result is cached, so the second access is a dictionary lookup. Nested tables come back as proxies too, so you pay only for the path you walk.
+
+Because the trailer of a table is written after its children, the writer streams the tree to the file and never holds the whole encoded snapshot in memory.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import collections.abc
+import mmap
+import pickle
+import struct
+
+MAGIC = b"PCLZ1"
+LEAF = b"P"
+DICT = b"D"
+LIST = b"L"
+TRAILER = struct.Struct("<QQ")
+ROOT = struct.Struct("<QQ")
+
+# containers encoded in fewer bytes than this are stored as a single pickle
+THRESHOLD = 4096
+# containers with at most this many items are sized by pickling them first
+SMALL_COUNT = 1024
+
+
+class _Writer:
+    def __init__(self, file, threshold, protocol):
+        self.file = file
+        self.threshold = threshold
+        self.protocol = protocol
+
+    def _leaf(self, obj):
+        start = self.file.tell()
+        self.file.write(LEAF)
+        pickle.dump(obj, self.file, self.protocol)
+        return start, self.file.tell()
+
+    def write(self, obj, root=False):
+        kind = type(obj)
+        if kind is dict:
+            tag, keys, children = DICT, list(obj), obj.values()
+        elif kind is list:
+            tag, keys, children = LIST, None, obj
+        else:
+            return self._leaf(obj)
+        if not root and len(obj) <= SMALL_COUNT:
+            data = pickle.dumps(obj, self.protocol)
+            if len(data) < self.threshold:
+                start = self.file.tell()
+                self.file.write(LEAF + data)
+                return start, self.file.tell()
+        start = self.file.tell()
+        self.file.write(tag)
+        offsets = [self.write(child)[0] for child in children]
+        offsets.append(self.file.tell())
+        self.file.write(struct.pack("<{}Q".format(len(offsets)), *offsets))
+        keys_data = pickle.dumps(keys, self.protocol) if keys is not None else b""
+        self.file.write(keys_data)
+        self.file.write(TRAILER.pack(len(offsets) - 1, len(keys_data)))
+        end = self.file.tell()
+        if not root and end - start < self.threshold:
+            # too small to be worth a table: replace it by a plain pickle
+            self.file.seek(start)
+            self.file.truncate()
+            return self._leaf(obj)
+        return start, end
+
+
+def dump(obj, filename, threshold=THRESHOLD, protocol=pickle.HIGHEST_PROTOCOL):
+    with open(filename, "wb") as file_out:
+        file_out.write(MAGIC)
+        start, end = _Writer(file_out, threshold, protocol).write(obj, root=True)
+        file_out.write(ROOT.pack(start, end))
+
+
+def _decode(snapshot, start, end):
+    data = snapshot.data
+    tag = data[start:start + 1]
+    if tag == LEAF:
+        return pickle.loads(data[start + 1:end])
+    count, keys_len = TRAILER.unpack_from(data, end - TRAILER.size)
+    keys_start = end - TRAILER.size - keys_len
+    offsets_start = keys_start - (count + 1) * 8
+    offsets = struct.unpack_from("<{}Q".format(count + 1), data, offsets_start)
+    if tag == DICT:
+        keys = pickle.loads(data[keys_start:keys_start + keys_len])
+        return LazyDict(snapshot, keys, offsets)
+    return LazyList(snapshot, offsets)
+
+
+class _LazyNode:
+    def __init__(self, snapshot, offsets):
+        self._snapshot = snapshot
+        self._offsets = offsets
+        self._cache = {}
+
+    def _child(self, index):
+        try:
+            return self._cache[index]
+        except KeyError:
+            value = self._cache[index] = _decode(self._snapshot, self._offsets[index], self._offsets[index + 1])
+            return value
+
+
+def materialize(value):
+    """Turns a lazy proxy (and everything below it) into plain dicts and lists."""
+    if isinstance(value, LazyDict):
+        return {key: materialize(value[key]) for key in value}
+    if isinstance(value, LazyList):
+        return [materialize(item) for item in value]
+    return value
+
+
+class LazyDict(_LazyNode, collections.abc.Mapping):
+    def __init__(self, snapshot, keys, offsets):
+        _LazyNode.__init__(self, snapshot, offsets)
+        self._keys = keys
+        self._index = {key: index for index, key in enumerate(keys)}
+
+    def __getitem__(self, key):
+        return self._child(self._index[key])
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return "<LazyDict with {} keys>".format(len(self))
+
+
+class LazyList(_LazyNode, collections.abc.Sequence):
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("LazyList index out of range")
+        return self._child(index)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __repr__(self):
+        return "<LazyList with {} items>".format(len(self))
+
+
+class LazySnapshot:
+    """An open lazy file; .root is the top-level LazyDict or LazyList."""
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise pickle.UnpicklingError("not a lazy pickle file: {}".format(filename))
+        start, end = ROOT.unpack_from(self.data, len(self.data) - ROOT.size)
+        self.root = _decode(self, start, end)
+
+    def close(self):
+        self.root = None
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self.root
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_lazy(filename):
+    return LazySnapshot(filename)
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    a_dict = dict()
+    a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+    a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+    a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+    a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    dump(a_dict, "multidata.lazy")
+    with open_lazy("multidata.lazy") as data1:
+        print(data1, data1["USD"])
+
+    snapshot = {
+        "rates": a_dict,
+        "history": {"day{}".format(day): [{"code": code, "rate": day * 0.01 + i} for i in range(250) for code in a_dict] for day in range(2000)},
+        "ticks": [list(range(i, i + 100)) for i in range(20000)],
+    }
+    start = time.perf_counter()
+    dump(snapshot, "snapshot.lazy")
+    with open("snapshot.pckl", "wb") as file_out:
+        pickle.dump(snapshot, file_out, pickle.HIGHEST_PROTOCOL)
+    print("written in {:.2f} s, {} MB".format(time.perf_counter() - start, os.path.getsize("snapshot.lazy") // 2**20))
+
+    start = time.perf_counter()
+    with open("snapshot.pckl", "rb") as file_in:
+        full = pickle.load(file_in)
+    print("pickle.load of everything: {:.3f} s".format(time.perf_counter() - start), full["rates"]["USD"])
+
+    start = time.perf_counter()
+    with open_lazy("snapshot.lazy") as root:
+        value = root["rates"]["USD"], root["history"]["day1999"][3], root["ticks"][-1][99]
+        print("lazy open and three lookups: {:.3f} s".format(time.perf_counter() - start), value)
+
+    os.remove("snapshot.pckl")
+    os.remove("snapshot.lazy")
@@ -0,0 +1,213 @@
+"""
+Sharing a shelf between processes
+shelve has no concurrency control: the notes in shelve_module.py already warn that the files must not be touched from outside while a shelf is open. Two processes writing the same shelf at once corrupt it, and a process reading while another one writes can see half of an update. dbm.dumb makes it worse by loading its '.dir' index into memory when the file is opened, so a reader doesn't even notice new keys written later.
+
+LockingShelf coordinates the processes with fcntl.flock() on a '.lock' file next to the shelf (so it works on Unix only):
+
+readers take a shared lock - any number of them can hold it at the same time;
+writers take an exclusive lock - it waits until no reader or other writer holds the lock, and keeps everyone else out meanwhile.
+
+A lock is held for a whole batch of operations:
+
+with shelf.reading():       with shelf.writing():
+    a = shelf["a"]              shelf["a"] -= 1
+    b = shelf["b"]              shelf["b"] += 1
+
+The database is opened when the batch starts and closed (which writes everything to disk) when it ends, so every batch sees a consistent snapshot: nothing can change between the two reads on the left, and nobody can see "a" without "b" on the right. A single operation outside a batch is a batch of its own.
+
+dbm writes every assignment to the file at once, so a writing() batch remembers the stored bytes of each key before its first change. If the block raises an exception, those are put back before the lock is released: the other processes see the shelf as it was before the batch, never half of it. (A process killed in the middle of a batch can't undo anything, of course.)
+
+Waiting for a lock is where the time goes when processes compete. Every acquisition is counted and timed, and stats() returns the totals.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import collections.abc
+import contextlib
+import fcntl
+import shelve
+import threading
+import time
+
+
+class LockingShelf(collections.abc.MutableMapping):
+    def __init__(self, filename, flag="c", protocol=None):
+        self.filename = filename
+        self.protocol = protocol
+        self.readonly = flag == "r"
+        self.shared_locks = 0
+        self.exclusive_locks = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self._lock_file = open(filename + ".lock", "ab")
+        self._thread_lock = threading.RLock()
+        self._shelf = None
+        self._exclusive = False
+        self._undo = None
+        if flag in ("c", "n"):
+            with self._batch(fcntl.LOCK_EX, flag):
+                pass
+
+    @contextlib.contextmanager
+    def _batch(self, mode, flag):
+        with self._thread_lock:
+            if self._shelf is not None:
+                # nested batch: the lock is already held
+                if mode == fcntl.LOCK_EX and not self._exclusive:
+                    raise RuntimeError("can't write inside a reading() batch")
+                yield self
+                return
+            start = time.perf_counter()
+            fcntl.flock(self._lock_file.fileno(), mode)
+            waited = time.perf_counter() - start
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            if mode == fcntl.LOCK_EX:
+                self.exclusive_locks += 1
+            else:
+                self.shared_locks += 1
+            try:
+                self._shelf = shelve.open(self.filename, flag, self.protocol)
+                self._exclusive = mode == fcntl.LOCK_EX
+                self._undo = {} if self._exclusive else None
+                try:
+                    yield self
+                except BaseException:
+                    if self._undo:
+                        self._rollback()
+                    raise
+                finally:
+                    shelf, self._shelf = self._shelf, None
+                    self._undo = None
+                    shelf.close()
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _remember(self, key):
+        # the bytes stored before the first change of key in this batch (None if it didn't exist)
+        key = key.encode(self._shelf.keyencoding)
+        if self._undo is not None and key not in self._undo:
+            self._undo[key] = self._shelf.dict.get(key)
+
+    def _rollback(self):
+        database = self._shelf.dict
+        for key, data in self._undo.items():
+            if data is None:
+                if key in database:
+                    del database[key]
+            else:
+                database[key] = data
+
+    def reading(self):
+        """Holds a shared lock for the duration of a with block."""
+        return self._batch(fcntl.LOCK_SH, "r")
+
+    def writing(self):
+        """Holds an exclusive lock for the duration of a with block."""
+        if self.readonly:
+            raise PermissionError("the shelf {!r} is opened for reading only".format(self.filename))
+        return self._batch(fcntl.LOCK_EX, "w")
+
+    def __getitem__(self, key):
+        with self.reading():
+            return self._shelf[key]
+
+    def __contains__(self, key):
+        with self.reading():
+            return key in self._shelf
+
+    def __len__(self):
+        with self.reading():
+            return len(self._shelf)
+
+    def __iter__(self):
+        with self.reading():
+            keys = list(self._shelf)
+        return iter(keys)
+
+    def __setitem__(self, key, value):
+        with self.writing():
+            self._remember(key)
+            self._shelf[key] = value
+
+    def __delitem__(self, key):
+        with self.writing():
+            self._remember(key)
+            del self._shelf[key]
+
+    def stats(self):
+        acquisitions = self.shared_locks + self.exclusive_locks
+        return {
+            "shared_locks": self.shared_locks,
+            "exclusive_locks": self.exclusive_locks,
+            "wait_seconds": self.wait_seconds,
+            "average_wait": self.wait_seconds / acquisitions if acquisitions else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    def close(self):
+        self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_locking(filename, flag="c", protocol=None):
+    return LockingShelf(filename, flag, protocol)
+
+
+if __name__ == "__main__":
+    import glob
+    import multiprocessing
+    import os
+
+    def writer(queue):
+        with open_locking("test_locking") as shelf:
+            for i in range(200):
+                with shelf.writing():
+                    shelf["a"] -= 1
+                    shelf["b"] += 1
+                    shelf["hits"] += 1
+            queue.put(("writer", shelf.stats()))
+
+    def reader(queue):
+        torn = 0
+        with open_locking("test_locking", flag="r") as shelf:
+            for i in range(200):
+                with shelf.reading():
+                    if shelf["a"] + shelf["b"] != 0:
+                        torn += 1
+            queue.put(("reader ({} torn snapshots)".format(torn), shelf.stats()))
+
+    with open_locking("test_locking", flag="n") as shelf:
+        with shelf.writing():
+            shelf.update({"a": 0, "b": 0, "hits": 0})
+
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=writer, args=(queue,)) for _ in range(4)]
+    workers += [multiprocessing.Process(target=reader, args=(queue,)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        name, stats = queue.get()
+        print(name, {key: round(value, 4) for key, value in stats.items()})
+    for worker in workers:
+        worker.join()
+
+    with open_locking("test_locking") as shelf:
+        print("hits:", shelf["hits"], "(expected 800)", "a + b =", shelf["a"] + shelf["b"])
+        try:
+            with shelf.writing():
+                shelf["a"] -= 1
+                del shelf["hits"]
+                shelf["new"] = 1
+                raise ValueError("abandoned batch")
+        except ValueError:
+            pass
+        assert shelf["a"] + shelf["b"] == 0 and shelf["hits"] == 800 and "new" not in shelf
+
+    for path in glob.glob("test_locking*"):
+        os.remove(path)
@@ -0,0 +1,283 @@
+"""
+Sorted keys, ranges and prefixes for shelves
+The keys of a shelf come out in whatever order the dbm module keeps them. To list the currencies from "C" to "G", or all the keys starting with "US", you have to load every key, sort them and filter them - every time.
+
+OrderedShelf keeps a sorted index of its keys in a '.keys' file next to the shelf. The index is cut into blocks of a few hundred keys:
+
+block 0: ["AUD", "CAD", "CHF", ...]   block 1: ["GBP", "HKD", ...]   ...
+
+and ends with a small directory listing the first key of every block and where the block is stored. Opening the shelf reads only that directory; a block is unpickled when a lookup or a scan actually reaches it. Finding where a key belongs is a binary search (bisect) over the first keys, then another one inside the block.
+
+range(start, stop) yields the (key, value) pairs with start <= key < stop in sorted order, prefix(p) the ones whose key starts with p, and both accept reverse=True. Values are unpickled one by one as the iteration reaches them, so stopping early costs nothing. Iterating over the shelf itself (for key in shelf, reversed(shelf)) follows the sorted order too.
+
+Inserting a key modifies one block in memory, splitting it when it grows too big. On sync() only the modified blocks are appended to the file, followed by a new directory; the file is rewritten from scratch once more than half of it is stale. A '.keys.dirty' marker exists while there are unsaved changes: if the program crashes, the next open() finds it and rebuilds the index from the keys of the shelf.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import bisect
+import dbm
+import os
+import pickle
+import shelve
+import struct
+
+BLOCK_SIZE = 512
+TRAILER = struct.Struct("<QQ")
+
+
+class _Block:
+    __slots__ = ("first", "offset", "length", "keys", "dirty")
+
+    def __init__(self, first, offset=0, length=0, keys=None, dirty=False):
+        self.first = first
+        self.offset = offset
+        self.length = length
+        self.keys = keys
+        self.dirty = dirty
+
+
+def _successor(prefix):
+    """The smallest string greater than every string starting with prefix (None if there is none)."""
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class OrderedShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, block_size=BLOCK_SIZE):
+        self.index_path = filename + ".keys"
+        self.block_size = block_size
+        self.readonly = flag == "r"
+        self.blocks_read = 0
+        self._file = None
+        self._blocks = []
+        self._firsts = []
+        self._marked = False
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        if flag == "n" or not os.path.exists(self.index_path) or os.path.exists(self.index_path + ".dirty"):
+            self._rebuild()
+        else:
+            self._open_index()
+
+    def _open_index(self):
+        self._file = open(self.index_path, "rb")
+        self._file.seek(-TRAILER.size, os.SEEK_END)
+        offset, length = TRAILER.unpack(self._file.read(TRAILER.size))
+        self._file.seek(offset)
+        self._blocks = [_Block(*entry) for entry in pickle.loads(self._file.read(length))]
+        self._firsts = [block.first for block in self._blocks]
+
+    def _rebuild(self):
+        keys = sorted(key.decode(self.keyencoding) for key in self.dict.keys())
+        self._blocks = [
+            _Block(keys[i], keys=keys[i:i + self.block_size], dirty=True) for i in range(0, len(keys), self.block_size)
+        ]
+        self._firsts = [block.first for block in self._blocks]
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self.readonly:
+            self._mark()
+
+    def _load(self, block):
+        if block.keys is None:
+            self._file.seek(block.offset)
+            block.keys = pickle.loads(self._file.read(block.length))
+            self.blocks_read += 1
+        return block.keys
+
+    def _find(self, key):
+        return max(bisect.bisect_right(self._firsts, key) - 1, 0)
+
+    def _mark(self):
+        if not self._marked:
+            open(self.index_path + ".dirty", "wb").close()
+            self._marked = True
+
+    def _insert(self, key):
+        if not self._blocks:
+            self._blocks.append(_Block(key, keys=[key], dirty=True))
+            self._firsts.append(key)
+            return True
+        i = self._find(key)
+        block = self._blocks[i]
+        keys = self._load(block)
+        j = bisect.bisect_left(keys, key)
+        if j < len(keys) and keys[j] == key:
+            return False
+        keys.insert(j, key)
+        block.dirty = True
+        if j == 0:
+            block.first = self._firsts[i] = key
+        if len(keys) > 2 * self.block_size:
+            half = len(keys) // 2
+            new = _Block(keys[half], keys=keys[half:], dirty=True)
+            del keys[half:]
+            self._blocks.insert(i + 1, new)
+            self._firsts.insert(i + 1, new.first)
+        return True
+
+    def _remove(self, key):
+        if not self._blocks:
+            return
+        i = self._find(key)
+        block = self._blocks[i]
+        keys = self._load(block)
+        j = bisect.bisect_left(keys, key)
+        if j == len(keys) or keys[j] != key:
+            return
+        del keys[j]
+        block.dirty = True
+        if not keys:
+            del self._blocks[i]
+            del self._firsts[i]
+        elif j == 0:
+            block.first = self._firsts[i] = keys[0]
+
+    def __setitem__(self, key, value):
+        # marked before the write, which dbm may persist at once: after a crash in between,
+        # the marker makes the next open rebuild the index instead of missing the key
+        if key.encode(self.keyencoding) not in self.dict:
+            self._mark()
+        shelve.Shelf.__setitem__(self, key, value)
+        self._insert(key)
+
+    def __delitem__(self, key):
+        self._mark()
+        shelve.Shelf.__delitem__(self, key)
+        self._remove(key)
+
+    def _iter_keys(self, start=None, stop=None, reverse=False):
+        if not reverse:
+            first = 0 if start is None else self._find(start)
+            for block in self._blocks[first:]:
+                keys = self._load(block)
+                low = 0 if start is None else bisect.bisect_left(keys, start)
+                for key in keys[low:]:
+                    if stop is not None and key >= stop:
+                        return
+                    yield key
+        else:
+            last = len(self._blocks) if stop is None else bisect.bisect_left(self._firsts, stop)
+            for block in reversed(self._blocks[:last]):
+                keys = self._load(block)
+                high = len(keys) if stop is None else bisect.bisect_left(keys, stop)
+                for key in reversed(keys[:high]):
+                    if start is not None and key < start:
+                        return
+                    yield key
+
+    def __iter__(self):
+        return self._iter_keys()
+
+    def __reversed__(self):
+        return self._iter_keys(reverse=True)
+
+    def range(self, start=None, stop=None, reverse=False):
+        """Yields the (key, value) pairs with start <= key < stop, in sorted order."""
+        for key in self._iter_keys(start, stop, reverse):
+            yield key, self[key]
+
+    def prefix(self, prefix, reverse=False):
+        """Yields the (key, value) pairs whose key starts with prefix, in sorted order."""
+        return self.range(prefix, _successor(prefix), reverse)
+
+    def _live_bytes(self):
+        return sum(block.length for block in self._blocks)
+
+    def _write_blocks(self, file_out, blocks):
+        for block in blocks:
+            data = pickle.dumps(block.keys, pickle.HIGHEST_PROTOCOL)
+            block.offset = file_out.tell()
+            block.length = len(data)
+            block.dirty = False
+            file_out.write(data)
+        directory = pickle.dumps(
+            [(block.first, block.offset, block.length) for block in self._blocks], pickle.HIGHEST_PROTOCOL
+        )
+        offset = file_out.tell()
+        file_out.write(directory)
+        file_out.write(TRAILER.pack(offset, len(directory)))
+
+    def _save_index(self):
+        size = os.path.getsize(self.index_path) if self._file is not None else 0
+        dirty = [block for block in self._blocks if block.dirty]
+        live = self._live_bytes() - sum(block.length for block in dirty)
+        if self._file is not None and size < 2 * (live + 64 * 1024):
+            with open(self.index_path, "ab") as file_out:
+                self._write_blocks(file_out, dirty)
+        else:
+            for block in self._blocks:
+                self._load(block)
+            with open(self.index_path + ".tmp", "wb") as file_out:
+                self._write_blocks(file_out, self._blocks)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.index_path, "rb")
+        os.remove(self.index_path + ".dirty")
+        self._marked = False
+
+    def sync(self):
+        shelve.Shelf.sync(self)
+        if self._marked and not isinstance(self.dict, shelve._ClosedDict):
+            self._save_index()
+
+    def close(self):
+        try:
+            shelve.Shelf.close(self)
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def open_ordered(filename, flag="c", protocol=None, block_size=BLOCK_SIZE):
+    return OrderedShelf(filename, flag, protocol, block_size)
+
+
+if __name__ == "__main__":
+    import glob
+    import time
+
+    shelve_name = "first_shelve.shlv"
+
+    with open_ordered(shelve_name, flag="n") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+        my_shelve["CAD"] = {"code": "Canadian dollar", "symbol": "$"}
+        my_shelve["USN"] = {"code": "US dollar (next day)", "symbol": "$"}
+
+    with open_ordered(shelve_name, flag="r") as my_shelve:
+        print(list(my_shelve))
+        print(list(reversed(my_shelve)))
+        print([key for key, value in my_shelve.range("CAD", "JPY")])
+        print(dict(my_shelve.prefix("US", reverse=True)))
+
+    with open_ordered("test_ordered", flag="n") as my_shelve:
+        for i in range(200000):
+            my_shelve["key{:07d}".format((i * 7919) % 200000)] = i
+
+    start = time.perf_counter()
+    with shelve.open("test_ordered", flag="r") as plain:
+        opened = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = sorted(key for key in plain.keys() if key.startswith("key01234"))
+        print("plain shelf: open {:.4f} s, load and sort every key {:.4f} s".format(opened, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with open_ordered("test_ordered", flag="r") as my_shelve:
+        opened = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [key for key, value in my_shelve.prefix("key01234")]
+        scanned = time.perf_counter() - start
+        print("ordered shelf: open {:.4f} s, prefix scan {:.5f} s: {} keys, {} of {} blocks read".format(
+            opened, scanned, len(found), my_shelve.blocks_read, len(my_shelve._blocks)))
+    assert found == expected
+
+    for path in glob.glob("test_ordered*"):
+        os.remove(path)
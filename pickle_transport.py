@@ -0,0 +1,440 @@
+"""
+Sending pickles over local sockets
+serialization.py ends the pickle.dumps() example with the comment "now pass 'bytes' to appropriate driver". This module is such a driver for processes running on the same machine.
+
+A socket delivers a stream of bytes, not separate messages, so every pickle is 'framed': it is preceded by a 4-byte big-endian length, and the receiver first reads the length, then exactly that many bytes.
+
+On top of the framing there is a tiny remote call protocol:
+
+the request is the tuple (request_id, name, args, kwargs);
+the reply is the tuple (request_id, ok, result) - when ok is False, result is the exception raised by the callable, and the client raises it again.
+
+PickleServer dispatches the requests to the callables registered with register(). Every connection is served by its own thread, and requests on one connection are answered in order.
+
+PickleClient keeps a pool of open connections, so a call doesn't pay for a new connection (and, for TCP, a handshake). pipeline() sends a whole batch of requests without waiting for the replies, so the batch costs one round trip instead of one per call; the replies are read while the requests are still being sent, otherwise a big batch would fill the socket buffers in both directions and block both sides forever. A reply that can't be pickled, or a request that can't be understood, is answered with a RemoteError. AsyncPickleClient offers the same for asyncio code.
+
+The address is either a (host, port) tuple for TCP or a path string for a Unix domain socket.
+
+Remember the warning from serialization.py: unpickling executes code, so never expose such a server to an untrusted network - bind it to localhost or a Unix socket with proper file permissions.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import asyncio
+import itertools
+import os
+import pickle
+import queue
+import selectors
+import socket
+import socketserver
+import struct
+import threading
+
+HEADER = struct.Struct("!I")
+PROTOCOL = pickle.HIGHEST_PROTOCOL
+CHUNK = 256 * 1024
+
+
+class RemoteError(Exception):
+    """Raised by the client when a remote exception can't be unpickled."""
+
+
+def _frame(obj):
+    payload = pickle.dumps(obj, PROTOCOL)
+    return HEADER.pack(len(payload)) + payload
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while size:
+        received = sock.recv_into(view[len(buffer) - size:], size)
+        if not received:
+            raise ConnectionError("connection closed by peer")
+        size -= received
+    return buffer
+
+
+def send_frame(sock, obj):
+    sock.sendall(_frame(obj))
+
+
+def _recv_payload(sock):
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return _recv_exact(sock, length)
+
+
+def recv_frame(sock):
+    return pickle.loads(_recv_payload(sock))
+
+
+def _exchange(sock, data, count):
+    """Sends data while reading count reply frames.
+
+    Sending everything before reading would deadlock on big batches: the server blocks writing replies nobody
+    reads, and stops reading requests, so the client blocks sending them.
+    """
+    view = memoryview(data)
+    buffer = bytearray()
+    replies = []
+    sock.setblocking(False)
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            while len(replies) < count:
+                for key, events in selector.select():
+                    if events & selectors.EVENT_WRITE and view:
+                        try:
+                            view = view[sock.send(view[:CHUNK]):]
+                        except BlockingIOError:
+                            pass
+                        if not view:
+                            selector.modify(sock, selectors.EVENT_READ)
+                    if events & selectors.EVENT_READ:
+                        try:
+                            chunk = sock.recv(CHUNK)
+                        except BlockingIOError:
+                            continue
+                        if not chunk:
+                            raise ConnectionError("connection closed by peer")
+                        buffer += chunk
+                        while len(buffer) >= HEADER.size:
+                            (length,) = HEADER.unpack_from(buffer)
+                            if len(buffer) < HEADER.size + length:
+                                break
+                            replies.append(pickle.loads(buffer[HEADER.size:HEADER.size + length]))
+                            del buffer[:HEADER.size + length]
+    finally:
+        sock.setblocking(True)
+    return replies
+
+
+async def read_frame(reader):
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(length))
+
+
+def write_frame(writer, obj):
+    writer.write(_frame(obj))
+
+
+def _connect(address):
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.connect(address)
+    return sock
+
+
+def _unpack_reply(reply):
+    _, ok, result = reply
+    if not ok:
+        raise result
+    return result
+
+
+def _safe_error(error):
+    # the exception is sent back to the client, so it must survive pickling
+    try:
+        pickle.dumps(error, PROTOCOL)
+        return error
+    except Exception:
+        return RemoteError("{}: {}".format(type(error).__name__, error))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        if self.request.family != socket.AF_UNIX:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _reply(self, payload):
+        request_id = None
+        try:
+            request = pickle.loads(payload)
+            if isinstance(request, tuple) and request:
+                request_id = request[0]
+            request_id, name, args, kwargs = request
+        except Exception as error:
+            return (request_id, False, RemoteError("malformed request: {}: {}".format(type(error).__name__, error)))
+        function = self.server.functions.get(name)
+        if function is None:
+            return (request_id, False, LookupError("no function registered as {!r}".format(name)))
+        try:
+            return (request_id, True, function(*args, **kwargs))
+        except Exception as error:
+            return (request_id, False, _safe_error(error))
+
+    def handle(self):
+        while True:
+            try:
+                payload = _recv_payload(self.request)
+            except OSError:
+                return
+            reply = self._reply(payload)
+            try:
+                data = _frame(reply)
+            except Exception as error:
+                # typically a result that can't be pickled
+                data = _frame((reply[0], False, RemoteError("{}: {}".format(type(error).__name__, error))))
+            try:
+                self.request.sendall(data)
+            except OSError:
+                return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class PickleServer:
+    """Serves the registered callables at address until shutdown() is called."""
+
+    def __init__(self, address):
+        self.address = address
+        self.functions = {}
+        self._server = None
+        self._thread = None
+
+    def register(self, function=None, name=None):
+        """Registers a callable; usable as a plain call or as a decorator."""
+        if function is None:
+            return lambda function: self.register(function, name)
+        self.functions[name or function.__name__] = function
+        return function
+
+    def _make_server(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            server = _UnixServer(self.address, _Handler)
+        else:
+            server = _TCPServer(self.address, _Handler)
+            self.address = server.server_address
+        server.functions = self.functions
+        return server
+
+    def serve_forever(self):
+        self._server = self._make_server()
+        self._server.serve_forever()
+
+    def start(self):
+        """Serves in a background thread and returns once the server is listening."""
+        self._server = self._make_server()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+
+
+class PickleClient:
+    """Thread-safe client with a pool of up to pool_size connections."""
+
+    def __init__(self, address, pool_size=4):
+        self.address = address
+        self._pool = queue.LifoQueue()
+        self._slots = threading.Semaphore(pool_size)
+        self._ids = itertools.count()
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            try:
+                return _connect(self.address)
+            except BaseException:
+                self._slots.release()
+                raise
+
+    def _release(self, sock, broken=False):
+        if broken:
+            sock.close()
+        else:
+            self._pool.put(sock)
+        self._slots.release()
+
+    def pipeline(self, calls):
+        """Sends all (name, args, kwargs) calls at once and returns their results in order."""
+        calls = list(calls)
+        sock = self._acquire()
+        try:
+            ids = [next(self._ids) for _ in calls]
+            data = b"".join(_frame((request_id,) + tuple(call)) for request_id, call in zip(ids, calls))
+            if len(calls) == 1:
+                # the server reads a whole request before replying, so a single one can't deadlock
+                sock.sendall(data)
+                replies = [recv_frame(sock)]
+            else:
+                replies = _exchange(sock, data, len(calls))
+        except BaseException:
+            self._release(sock, broken=True)
+            raise
+        self._release(sock)
+        return [_unpack_reply(reply) for reply in replies]
+
+    def call(self, name, *args, **kwargs):
+        return self.pipeline([(name, args, kwargs)])[0]
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class AsyncPickleClient:
+    """asyncio version of PickleClient."""
+
+    def __init__(self, address, pool_size=4):
+        self.address = address
+        self.pool_size = pool_size
+        self._pool = []
+        self._slots = None
+        self._ids = itertools.count()
+
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        await self._slots.acquire()
+        if self._pool:
+            return self._pool.pop()
+        try:
+            if isinstance(self.address, str):
+                return await asyncio.open_unix_connection(self.address)
+            reader, writer = await asyncio.open_connection(*self.address)
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return reader, writer
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, broken=False):
+        if broken:
+            connection[1].close()
+        else:
+            self._pool.append(connection)
+        self._slots.release()
+
+    async def pipeline(self, calls):
+        calls = list(calls)
+        connection = await self._acquire()
+        reader, writer = connection
+
+        async def send():
+            for call in calls:
+                write_frame(writer, (next(self._ids),) + tuple(call))
+            await writer.drain()
+
+        # replies are read while the requests are still being sent, see _exchange()
+        sending = asyncio.ensure_future(send())
+        try:
+            replies = [await read_frame(reader) for _ in calls]
+            await sending
+        except BaseException:
+            sending.cancel()
+            self._release(connection, broken=True)
+            raise
+        self._release(connection)
+        return [_unpack_reply(reply) for reply in replies]
+
+    async def call(self, name, *args, **kwargs):
+        return (await self.pipeline([(name, args, kwargs)]))[0]
+
+    async def close(self):
+        while self._pool:
+            _, writer = self._pool.pop()
+            writer.close()
+            await writer.wait_closed()
+
+
+if __name__ == "__main__":
+    import time
+
+    a_dict = dict()
+    a_dict["EUR"] = {"code": "Euro", "symbol": "€"}
+    a_dict["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+    a_dict["USD"] = {"code": "US dollar", "symbol": "$"}
+    a_dict["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    server = PickleServer("pickle_transport.sock")
+
+    @server.register
+    def currency(code):
+        return a_dict[code]
+
+    @server.register
+    def echo(obj):
+        return obj
+
+    @server.register
+    def make_lock():
+        return threading.Lock()
+
+    with server, PickleClient(server.address) as client:
+        print(client.call("currency", "USD"))
+        try:
+            client.call("currency", "XXX")
+        except KeyError as error:
+            print("remote KeyError:", error)
+        try:
+            client.call("make_lock")
+        except RemoteError as error:
+            print("unpicklable result:", error)
+        with _connect(server.address) as sock:
+            send_frame(sock, ("not", "a request"))
+            print("malformed request:", recv_frame(sock))
+
+        # far more than the socket buffers can hold in either direction
+        big_batch = [("echo", ("x" * 1000,), {})] * 1000
+        assert client.pipeline(big_batch) == ["x" * 1000] * 1000
+
+        a_list = ["a", 123, [10, 100, 1000]]
+        start = time.perf_counter()
+        for _ in range(5000):
+            client.call("echo", a_list)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(50):
+            client.pipeline([("echo", (a_list,), {})] * 100)
+        pipelined = time.perf_counter() - start
+        print("5000 calls: one by one {:.3f} s, pipelined {:.3f} s".format(single, pipelined))
+
+        async def main():
+            async_client = AsyncPickleClient(server.address)
+            results = await asyncio.gather(*(async_client.call("currency", code) for code in a_dict))
+            assert await async_client.pipeline(big_batch) == ["x" * 1000] * 1000
+            await async_client.close()
+            return results
+
+        print(asyncio.run(main()))
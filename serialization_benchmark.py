@@ -0,0 +1,221 @@
+"""
+Measuring serialization
+serialization.py and shelve_module.py show how to use pickle.dump()/load()/dumps()/loads() and shelve, but not what they cost. This script measures it.
+
+The data sets are scaled-up versions of the objects used in those examples:
+
+'a_dict' - the currency table, with n currencies instead of four;
+'a_list' - the nested list ["a", 123, [10, 100, 1000]], repeated n times;
+'cucumbers' - n Cucumber objects.
+
+Every data set is dumped and loaded with each pickle protocol, with marshal and with json (where the format supports the data - marshal and json can't store class instances), and is written to and read back from a shelve. For every run we record:
+
+the dump and load throughput (entries of the data set per second, best of a few repeats) - the same input for every format, so a format with a bigger output doesn't look faster for it;
+the size of the output;
+the peak memory allocated while dumping and loading (measured with tracemalloc, in a separate pass so that tracing doesn't distort the timings).
+
+The results are written to a JSON file (the 'baseline'). When a baseline already exists, the new results are compared with it, and every measurement that got slower or bigger by more than the tolerance is reported as a regression. A baseline measured with a different --scale can't be compared: the script says so and fails, unless --update replaces it.
+
+python serialization_benchmark.py --scale 10000
+python serialization_benchmark.py --scale 10000 --update   # accept the new numbers as the baseline
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import argparse
+import json
+import marshal
+import os
+import pickle
+import shelve
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+class Cucumber:
+    def __init__(self):
+        self.size = "small"
+
+    def get_size(self):
+        return self.size
+
+
+def make_dict(n):
+    a_dict = dict()
+    symbols = ["€", "£", "$", "¥"]
+    for i in range(n):
+        a_dict["C{:05d}".format(i)] = {"code": "Currency number {}".format(i), "symbol": symbols[i % 4]}
+    return a_dict
+
+
+def make_list(n):
+    return [["a", 123, [10, 100, 1000]] for _ in range(n)]
+
+
+def make_cucumbers(n):
+    return [Cucumber() for _ in range(n)]
+
+
+DATASETS = {"a_dict": make_dict, "a_list": make_list, "cucumbers": make_cucumbers}
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def formats():
+    result = {}
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        result["pickle-{}".format(protocol)] = (
+            lambda obj, protocol=protocol: pickle.dumps(obj, protocol),
+            pickle.loads,
+        )
+    result["marshal"] = (marshal.dumps, marshal.loads)
+    result["json"] = (_json_dumps, _json_loads)
+    return result
+
+
+def _best_time(func, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _peak_memory(func, arg):
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_format(obj, dumps, loads, repeat):
+    dump_time, data = _best_time(dumps, obj, repeat)
+    load_time, _ = _best_time(loads, data, repeat)
+    return {
+        "size": len(data),
+        "dump_ops_s": len(obj) / dump_time,
+        "load_ops_s": len(obj) / load_time,
+        "dump_peak": _peak_memory(dumps, obj),
+        "load_peak": _peak_memory(loads, data),
+    }
+
+
+def bench_shelve(obj, repeat):
+    items = obj.items() if isinstance(obj, dict) else [(str(i), value) for i, value in enumerate(obj)]
+    items = list(items)
+    best_put = best_get = float("inf")
+    with tempfile.TemporaryDirectory() as directory:
+        for attempt in range(repeat):
+            path = os.path.join(directory, "bench{}".format(attempt))
+            with shelve.open(path, flag="n") as shelf:
+                start = time.perf_counter()
+                for key, value in items:
+                    shelf[key] = value
+                shelf.sync()
+                best_put = min(best_put, time.perf_counter() - start)
+            with shelve.open(path, flag="r") as shelf:
+                start = time.perf_counter()
+                for key, _ in items:
+                    shelf[key]
+                best_get = min(best_get, time.perf_counter() - start)
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if name.startswith("bench{}.".format(attempt)))
+    return {
+        "size": size,
+        "put_ops_s": len(items) / best_put,
+        "get_ops_s": len(items) / best_get,
+    }
+
+
+def run(scale, repeat=3):
+    results = {}
+    for name, factory in DATASETS.items():
+        obj = factory(scale)
+        for fmt, (dumps, loads) in formats().items():
+            try:
+                results["{}/{}".format(name, fmt)] = bench_format(obj, dumps, loads, repeat)
+            except (TypeError, ValueError):
+                pass  # marshal and json can't store class instances
+        results["{}/shelve".format(name)] = bench_shelve(obj, repeat)
+    return {
+        "python": sys.version.split()[0],
+        "scale": scale,
+        "results": results,
+    }
+
+
+# bigger is better for throughputs, smaller is better for sizes and memory
+_HIGHER_IS_BETTER = ("dump_ops_s", "load_ops_s", "put_ops_s", "get_ops_s")
+
+
+def compare(baseline, current, tolerance=0.2):
+    if baseline["scale"] != current["scale"]:
+        raise ValueError("the baseline was measured with --scale {}, this run with --scale {}".format(baseline["scale"], current["scale"]))
+    regressions = []
+    for key, metrics in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+        for metric, value in metrics.items():
+            if metric not in old or not old[metric]:
+                continue
+            change = value / old[metric] - 1
+            if metric in _HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append((key, metric, old[metric], value))
+    return regressions
+
+
+def report(current):
+    print("{:<22} {:>10} {:>10} {:>10} {:>12} {:>12}".format("benchmark", "size", "dump/put", "load/get", "dump peak", "load peak"))
+    for key, m in current["results"].items():
+        if "put_ops_s" in m:
+            print("{:<22} {:>10} {:>7.0f}/s {:>7.0f}/s".format(key, m["size"], m["put_ops_s"], m["get_ops_s"]))
+        else:
+            print("{:<22} {:>10} {:>7.0f}/s {:>7.0f}/s {:>12} {:>12}".format(key, m["size"], m["dump_ops_s"], m["load_ops_s"], m["dump_peak"], m["load_peak"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pickle, marshal, json and shelve.")
+    parser.add_argument("--scale", type=int, default=10000, help="number of entries in each data set")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default="serialization_baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown/growth")
+    parser.add_argument("--update", action="store_true", help="overwrite the baseline with this run")
+    args = parser.parse_args(argv)
+
+    current = run(args.scale, args.repeat)
+    report(current)
+
+    status = 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file_in:
+            baseline = json.load(file_in)
+        try:
+            regressions = compare(baseline, current, args.tolerance)
+        except ValueError as error:
+            print("can't compare with {}: {}".format(args.baseline, error), file=sys.stderr)
+            status = 2
+        else:
+            for key, metric, old, new in regressions:
+                print("REGRESSION {} {}: {:.4g} -> {:.4g}".format(key, metric, old, new))
+            status = 1 if regressions else 0
+    if args.update or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file_out:
+            json.dump(current, file_out, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
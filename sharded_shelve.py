@@ -0,0 +1,252 @@
+"""
+Splitting a shelf into shards
+shelve.open("test") gives you one dbm database: every write goes through the same index and the same .dat file, which only grows. When many threads or processes write, they all queue up behind that single file.
+
+A ShardedShelf spreads the keys over N ordinary shelves ('shards'), named test.00, test.01, ... The shard of a key is chosen by a stable hash (CRC32 of the encoded key, modulo N) - not by hash(), which is randomized for strings in every new Python process.
+
+From the outside it still behaves like a dictionary: len(), 'in', keys(), items(), update() and del work across all the shards. Inside, every shard has its own lock, so threads writing keys of different shards don't wait for each other.
+
+Several processes can share the work too, as long as no two of them open the same shard: pass only=[...] to open just some of the shards, and send each process the keys of its own shards (shard_of() tells you where a key goes). dbm keeps part of its index in memory, so two processes must never write the same shard.
+
+The number of shards is stored next to them in a small '.shards' file, so the shelf is always reopened with the right routing. To change it, use reshard(), which copies every item into a new set of shards and then swaps the files in. Before the swap starts, the list of file moves is written to a '.resharding' marker; if the program crashes during the swap, recover() - called by reshard() and when the shelf is opened - finishes it from the marker, and without a marker it removes the files of a copy that never got that far. reshard() and recover() hold an exclusive fcntl.flock() on a '.lock' file next to the shards (Unix only), so a process opening the shelf while another one is resharding waits for it to finish instead of deleting its copy.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import collections.abc
+import contextlib
+import fcntl
+import glob
+import json
+import os
+import shelve
+import threading
+import zlib
+
+# the files a dbm database may consist of, depending on the module
+SUFFIXES = ("", ".db", ".dat", ".dir", ".bak", ".pag")
+
+_held = {}  # absolute path -> [thread lock, lock file, depth]
+_held_lock = threading.Lock()
+
+
+def shard_of(key, count, keyencoding="utf-8"):
+    return zlib.crc32(key.encode(keyencoding)) % count
+
+
+def _shard_name(filename, index):
+    return "{}.{:02d}".format(filename, index)
+
+
+def _shard_files(name):
+    return [name + suffix for suffix in SUFFIXES if os.path.exists(name + suffix)]
+
+
+@contextlib.contextmanager
+def _locked(filename):
+    # reentrant within a process, since reshard() opens shelves that recover() too
+    with _held_lock:
+        entry = _held.setdefault(os.path.abspath(filename), [threading.RLock(), None, 0])
+    with entry[0]:
+        if not entry[2]:
+            entry[1] = open(filename + ".lock", "ab")
+            fcntl.flock(entry[1].fileno(), fcntl.LOCK_EX)
+        entry[2] += 1
+        try:
+            yield
+        finally:
+            entry[2] -= 1
+            if not entry[2]:
+                # closing the file releases the lock
+                entry[1].close()
+                entry[1] = None
+
+
+def _read_count(filename):
+    try:
+        with open(filename + ".shards") as file_in:
+            return json.load(file_in)["count"]
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as file_out:
+        json.dump(data, file_out)
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _write_count(filename, count):
+    _write_json(filename + ".shards", {"count": count})
+
+
+def _swap(filename, plan):
+    # every step can be repeated, so an interrupted swap is finished by running it again
+    for source, target in plan["moves"]:
+        if os.path.exists(source):
+            os.replace(source, target)
+    for path in plan["stale"]:
+        if os.path.exists(path):
+            os.remove(path)
+    _write_count(filename, plan["count"])
+    if os.path.exists(filename + ".reshard.shards"):
+        os.remove(filename + ".reshard.shards")
+    os.remove(filename + ".resharding")
+
+
+def recover(filename):
+    """Completes a reshard() interrupted by a crash, or removes the files of an unfinished one."""
+    with _locked(filename):
+        if os.path.exists(filename + ".resharding"):
+            with open(filename + ".resharding") as file_in:
+                _swap(filename, json.load(file_in))
+        else:
+            for path in glob.glob(glob.escape(filename + ".reshard") + ".*"):
+                os.remove(path)
+
+
+class ShardedShelf(collections.abc.MutableMapping):
+    def __init__(self, filename, count=8, flag="c", protocol=None, writeback=False, only=None):
+        with _locked(filename):
+            recover(filename)
+            existing = _read_count(filename)
+            if existing is not None and flag != "n":
+                count = existing
+            elif flag in ("c", "n"):
+                _write_count(filename, count)
+            else:
+                raise FileNotFoundError("no sharded shelf named {!r}".format(filename))
+        self.filename = filename
+        self.count = count
+        indices = range(count) if only is None else only
+        self.shards = {index: shelve.open(_shard_name(filename, index), flag, protocol, writeback) for index in indices}
+        self.locks = {index: threading.Lock() for index in self.shards}
+
+    def _shard(self, key):
+        index = shard_of(key, self.count)
+        try:
+            return self.shards[index], self.locks[index]
+        except KeyError:
+            raise KeyError("key {!r} belongs to shard {}, which isn't open here".format(key, index)) from None
+
+    def __getitem__(self, key):
+        shard, lock = self._shard(key)
+        with lock:
+            return shard[key]
+
+    def __setitem__(self, key, value):
+        shard, lock = self._shard(key)
+        with lock:
+            shard[key] = value
+
+    def __delitem__(self, key):
+        shard, lock = self._shard(key)
+        with lock:
+            del shard[key]
+
+    def __contains__(self, key):
+        try:
+            shard, lock = self._shard(key)
+        except KeyError:
+            return False
+        with lock:
+            return key in shard
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards.values())
+
+    def __iter__(self):
+        for index, shard in self.shards.items():
+            with self.locks[index]:
+                keys = list(shard)
+            yield from keys
+
+    def sync(self):
+        for index, shard in self.shards.items():
+            with self.locks[index]:
+                shard.sync()
+
+    def close(self):
+        for index, shard in self.shards.items():
+            with self.locks[index]:
+                shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_sharded(filename, count=8, flag="c", protocol=None, writeback=False, only=None):
+    return ShardedShelf(filename, count, flag, protocol, writeback, only)
+
+
+def reshard(filename, count, protocol=None):
+    """Redistributes all the items of a sharded shelf over count shards."""
+    with _locked(filename):
+        recover(filename)
+        temporary = filename + ".reshard"
+        with ShardedShelf(filename, flag="r") as old, ShardedShelf(temporary, count, "n", protocol) as new:
+            old_count = old.count
+            for key in old:
+                new[key] = old[key]
+        moves = []
+        for index in range(count):
+            source = _shard_name(temporary, index)
+            for path in _shard_files(source):
+                moves.append((path, _shard_name(filename, index) + path[len(source):]))
+        targets = {target for source, target in moves}
+        stale = [
+            path
+            for index in range(old_count)
+            for path in _shard_files(_shard_name(filename, index))
+            if path not in targets
+        ]
+        # from here on the new shards are complete: once the marker exists, a crash is finished by recover()
+        _write_json(filename + ".resharding", {"count": count, "moves": moves, "stale": stale})
+        recover(filename)
+        os.remove(temporary + ".lock")
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import time
+
+    with open_sharded("test_sharded", count=4, flag="n") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve.update({"USD": {"code": "US dollar", "symbol": "$"}, "JPY": {"code": "Japanese yen", "symbol": "¥"}})
+        del my_shelve["GBP"]
+        print(len(my_shelve), "USD" in my_shelve, sorted(my_shelve.keys()))
+
+    reshard("test_sharded", 2)
+    with open_sharded("test_sharded", flag="r") as my_shelve:
+        print(my_shelve.count, "shards:", dict(my_shelve.items()))
+
+    KEYS = 40000
+
+    def writer(filename, count, index, keys):
+        with open_sharded(filename, count, only=[index]) as shelf:
+            for key in keys:
+                shelf[key] = {"key": key, "code": "Euro", "symbol": "€"}
+
+    print("(the scaling is limited by the number of CPU cores: {})".format(os.cpu_count()))
+    for count in (1, 2, 4, 8):
+        open_sharded("bench_sharded", count, flag="n").close()
+        routed = {index: [] for index in range(count)}
+        for i in range(KEYS):
+            key = "key{}".format(i)
+            routed[shard_of(key, count)].append(key)
+        workers = [multiprocessing.Process(target=writer, args=("bench_sharded", count, index, routed[index])) for index in range(count)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print("{} shard(s): {:.0f} writes/s".format(count, KEYS / elapsed))
+    for path in glob.glob("bench_sharded*") + glob.glob("test_sharded*"):
+        os.remove(path)
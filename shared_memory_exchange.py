@@ -0,0 +1,162 @@
+"""
+Exchanging pickled objects through shared memory
+When a large object goes from one process to another through a multiprocessing.Queue or Pipe, its bytes are copied several times: pickle.dumps() copies them into the pickle, the pipe copies them into the kernel and back out, and pickle.loads() copies them again into the new object.
+
+Pickle protocol 5 (Python 3.8+) can keep big binary buffers out of the pickle: pickle.dumps(obj, protocol=5, buffer_callback=...) hands every buffer to the callback instead of writing it into the stream, and pickle.loads(data, buffers=...) gives them back when loading. Objects opt in by returning a pickle.PickleBuffer from __reduce_ex__() (numpy arrays do; the Blob class below does too).
+
+The exchange combines that with multiprocessing.shared_memory:
+
+the producer pickles the object, lays the out-of-band buffers out in a new shared memory segment and sends only a small header (segment name, the pickle without the buffers, buffer offsets) through the queue;
+the consumer maps the same segment and rebuilds the object with memoryviews pointing straight into it - the payload bytes are never copied on the consumer side.
+
+A segment must live until every consumer is done with it, and must then be removed, otherwise it stays in /dev/shm. The first 8 bytes of every segment hold a reference count: put() sets it to the number of readers, each Lease.release() decreases it under a lock shared by the processes, and whoever drops it to zero unlinks the segment.
+
+Before calling release(), drop every object that still refers to the segment - a memoryview into a closed segment can't exist, so release() raises BufferError if you don't. The segment is closed before the reference count is decreased, so after a BufferError the count is unchanged, and release() can simply be called again once the objects are gone.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import multiprocessing
+import pickle
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+REFCOUNT = struct.Struct("q")
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class Blob:
+    """A binary payload that pickle protocol 5 transfers out-of-band."""
+
+    def __init__(self, data):
+        self.data = memoryview(data).cast("B")
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return type(self), (pickle.PickleBuffer(self.data),)
+        return type(self), (bytes(self.data),)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Lease:
+    """An object read from shared memory, valid until release() is called."""
+
+    def __init__(self, exchange, segment, obj):
+        self.exchange = exchange
+        self.segment = segment
+        self.obj = obj
+
+    def release(self):
+        if self.segment is None:
+            return
+        self.obj = None
+        segment = self.segment
+        segment.close()
+        self.segment = None
+        self.exchange._unref(segment.name)
+
+    def __enter__(self):
+        return self.obj
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class SharedMemoryExchange:
+    """Create it in the parent process and pass it to the workers, like a Queue."""
+
+    def __init__(self, lock=None):
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+
+    def put(self, obj, readers=1):
+        """Moves obj's buffers into a new segment and returns the small header to send."""
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        layout = []
+        offset = _align(REFCOUNT.size)
+        raws = [buffer.raw() for buffer in buffers]
+        for raw in raws:
+            layout.append((offset, raw.nbytes))
+            offset = _align(offset + raw.nbytes)
+        segment = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        # from now on the reference count decides when the segment goes away,
+        # not the resource tracker of this process
+        resource_tracker.unregister(segment._name, "shared_memory")
+        try:
+            REFCOUNT.pack_into(segment.buf, 0, readers)
+            for (start, size), raw in zip(layout, raws):
+                segment.buf[start:start + size] = raw
+            return segment.name, data, layout
+        finally:
+            for raw in raws:
+                raw.release()
+            segment.close()
+
+    def get(self, header):
+        """Maps the segment named in header and returns a Lease on the rebuilt object."""
+        name, data, layout = header
+        segment = shared_memory.SharedMemory(name=name)
+        buffers = [segment.buf[start:start + size] for start, size in layout]
+        obj = pickle.loads(data, buffers=buffers)
+        for buffer in buffers:
+            buffer.release()
+        return Lease(self, segment, obj)
+
+    def _unref(self, name):
+        # the reader's own mapping is already closed: map the segment again just for the count
+        segment = shared_memory.SharedMemory(name=name)
+        with self.lock:
+            count = REFCOUNT.unpack_from(segment.buf, 0)[0] - 1
+            REFCOUNT.pack_into(segment.buf, 0, count)
+        segment.close()
+        if count == 0:
+            segment.unlink()
+        else:
+            # otherwise our resource tracker would remove it when this process exits
+            resource_tracker.unregister(segment._name, "shared_memory")
+
+
+if __name__ == "__main__":
+    import time
+
+    SIZE = 64 * 2**20
+    COUNT = 20
+
+    def queue_consumer(channel, results):
+        for _ in range(COUNT):
+            obj = channel.get()
+            results.put(obj["payload"].data[-1])
+
+    def shm_consumer(channel, results, exchange):
+        for _ in range(COUNT):
+            with exchange.get(channel.get()) as obj:
+                results.put(obj["payload"].data[-1])
+                del obj
+
+    def run(target, args, send):
+        channel = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=target, args=(channel, results) + args)
+        worker.start()
+        payload = {"name": "snapshot", "payload": Blob(bytearray(b"x" * SIZE))}
+        start = time.perf_counter()
+        for _ in range(COUNT):
+            channel.put(send(payload))
+        for _ in range(COUNT):
+            results.get()
+        elapsed = time.perf_counter() - start
+        worker.join()
+        return elapsed
+
+    exchange = SharedMemoryExchange()
+    plain = run(queue_consumer, (), lambda obj: obj)
+    shared = run(shm_consumer, (exchange,), exchange.put)
+    total = SIZE * COUNT / 2**20
+    print("Queue:         {:.3f} s ({:.0f} MB/s)".format(plain, total / plain))
+    print("shared memory: {:.3f} s ({:.0f} MB/s)".format(shared, total / shared))
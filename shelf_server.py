@@ -0,0 +1,291 @@
+"""
+A shelf server for many processes
+A shelf belongs to one process: dbm keeps part of its state in memory, so several processes opening the same shelf overwrite each other's changes. Instead of fighting over the files, the worker processes can ask a single server process that owns the shelf.
+
+ShelfServer opens the database and serves it with PickleServer from pickle_transport.py, usually over a Unix domain socket. It offers get, set, delete, contains, keys and length, plus get_many, set_many and delete_many to handle a batch of keys in one round trip. ShelfClient (a MutableMapping, so it's used like a shelf) and AsyncShelfClient talk to it, with the connection pooling and pipelining of PickleClient and AsyncPickleClient.
+
+The values travel pickled, and the server never unpickles them: the client pickles a value, the server stores those bytes in the database as they are, and returns them as they are to the client that reads them. The server doesn't even need the classes of the values.
+
+In front of the database, the server keeps the most recently used values (their pickled bytes) in an LRU read cache of cache_size entries, so popular keys are answered from memory. One lock serializes the access to the database and the cache, since dbm isn't thread-safe.
+
+For every operation the server counts the calls and measures the time spent, including the wait for the lock; stats() returns the counts, the average latencies, the cache hit ratio and the throughput since the server started.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import collections.abc
+import dbm
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from pickle_transport import AsyncPickleClient, PickleClient, PickleServer
+
+CACHE_SIZE = 10000
+OPERATIONS = ("get", "get_many", "set", "set_many", "delete", "delete_many", "contains", "keys", "length", "sync", "stats")
+
+
+class ShelfServer:
+    def __init__(self, filename, address, flag="c", cache_size=CACHE_SIZE, keyencoding="utf-8"):
+        self.db = dbm.open(filename, flag)
+        self.keyencoding = keyencoding
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.calls = Counter()
+        self.seconds = defaultdict(float)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.server = PickleServer(address)
+        for name in OPERATIONS:
+            self.server.register(self._timed(name, getattr(self, "_" + name)), name)
+
+    @property
+    def address(self):
+        return self.server.address
+
+    def _timed(self, name, function):
+        def timed(*args):
+            start = time.perf_counter()
+            with self._lock:
+                try:
+                    return function(*args)
+                finally:
+                    self.calls[name] += 1
+                    self.seconds[name] += time.perf_counter() - start
+
+        return timed
+
+    def _remember(self, key, data):
+        self.cache[key] = data
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _get(self, key):
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return data
+        self.misses += 1
+        data = self.db.get(key.encode(self.keyencoding))
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def _get_many(self, keys):
+        return [self._get(key) for key in keys]
+
+    def _set(self, key, data):
+        self.db[key.encode(self.keyencoding)] = data
+        self._remember(key, data)
+
+    def _set_many(self, items):
+        for key, data in items:
+            self._set(key, data)
+
+    def _delete(self, key):
+        self.cache.pop(key, None)
+        del self.db[key.encode(self.keyencoding)]
+
+    def _delete_many(self, keys):
+        deleted = 0
+        for key in keys:
+            try:
+                self._delete(key)
+                deleted += 1
+            except KeyError:
+                pass
+        return deleted
+
+    def _contains(self, key):
+        return key in self.cache or key.encode(self.keyencoding) in self.db
+
+    def _keys(self):
+        return [key.decode(self.keyencoding) for key in self.db.keys()]
+
+    def _length(self):
+        return len(self.db)
+
+    def _sync(self):
+        if hasattr(self.db, "sync"):
+            self.db.sync()
+
+    def _stats(self):
+        elapsed = time.perf_counter() - self.started
+        lookups = self.hits + self.misses
+        return {
+            "calls": dict(self.calls),
+            "average_latency": {name: self.seconds[name] / count for name, count in self.calls.items()},
+            "operations_per_second": sum(self.calls.values()) / elapsed,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_ratio": self.hits / lookups if lookups else 0.0,
+            "cached": len(self.cache),
+        }
+
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        with self._lock:
+            self.db.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+
+
+class ShelfClient(collections.abc.MutableMapping):
+    def __init__(self, address, pool_size=4, protocol=None):
+        self.protocol = protocol
+        self.client = PickleClient(address, pool_size)
+
+    def __getitem__(self, key):
+        data = self.client.call("get", key)
+        if data is None:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def __setitem__(self, key, value):
+        self.client.call("set", key, pickle.dumps(value, self.protocol))
+
+    def __delitem__(self, key):
+        self.client.call("delete", key)
+
+    def __contains__(self, key):
+        return self.client.call("contains", key)
+
+    def __len__(self):
+        return self.client.call("length")
+
+    def __iter__(self):
+        return iter(self.client.call("keys"))
+
+    def get_many(self, keys):
+        """Returns a {key: value} dictionary of the keys that exist."""
+        keys = list(keys)
+        return {key: pickle.loads(data) for key, data in zip(keys, self.client.call("get_many", keys)) if data is not None}
+
+    def set_many(self, mapping):
+        items = mapping.items() if hasattr(mapping, "items") else mapping
+        self.client.call("set_many", [(key, pickle.dumps(value, self.protocol)) for key, value in items])
+
+    def delete_many(self, keys):
+        """Deletes the keys that exist and returns how many there were."""
+        return self.client.call("delete_many", list(keys))
+
+    def sync(self):
+        self.client.call("sync")
+
+    def stats(self):
+        return self.client.call("stats")
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class AsyncShelfClient:
+    """asyncio version of ShelfClient."""
+
+    def __init__(self, address, pool_size=4, protocol=None):
+        self.protocol = protocol
+        self.client = AsyncPickleClient(address, pool_size)
+
+    async def get(self, key, default=None):
+        data = await self.client.call("get", key)
+        return default if data is None else pickle.loads(data)
+
+    async def set(self, key, value):
+        await self.client.call("set", key, pickle.dumps(value, self.protocol))
+
+    async def delete(self, key):
+        await self.client.call("delete", key)
+
+    async def contains(self, key):
+        return await self.client.call("contains", key)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        found = await self.client.call("get_many", keys)
+        return {key: pickle.loads(data) for key, data in zip(keys, found) if data is not None}
+
+    async def set_many(self, mapping):
+        items = mapping.items() if hasattr(mapping, "items") else mapping
+        await self.client.call("set_many", [(key, pickle.dumps(value, self.protocol)) for key, value in items])
+
+    async def delete_many(self, keys):
+        return await self.client.call("delete_many", list(keys))
+
+    async def stats(self):
+        return await self.client.call("stats")
+
+    async def close(self):
+        await self.client.close()
+
+
+if __name__ == "__main__":
+    import asyncio
+    import multiprocessing
+
+    address = "shelf_server.sock"
+
+    def worker(number, count):
+        with ShelfClient(address) as shelf:
+            for i in range(count):
+                key = "counter{}".format(i % 100)
+                shelf[key] = {"worker": number, "i": i}
+                shelf[key]
+            shelf.get_many("counter{}".format(i) for i in range(100))
+
+    with ShelfServer("test_server", address, flag="n") as server:
+        with ShelfClient(server.address) as my_shelve:
+            my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+            my_shelve.set_many({
+                "GBP": {"code": "Pounds sterling", "symbol": "£"},
+                "USD": {"code": "US dollar", "symbol": "$"},
+                "JPY": {"code": "Japanese yen", "symbol": "¥"},
+            })
+            del my_shelve["GBP"]
+            print(my_shelve["USD"], "GBP" in my_shelve, sorted(my_shelve))
+            print(my_shelve.get_many(["EUR", "GBP", "JPY"]))
+
+        async def main():
+            client = AsyncShelfClient(server.address)
+            values = await asyncio.gather(*(client.get(code) for code in ("EUR", "USD", "XYZ")))
+            await client.close()
+            return values
+
+        print(asyncio.run(main()))
+
+        workers = [multiprocessing.Process(target=worker, args=(number, 2000)) for number in range(4)]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        print("4 processes, 16400 operations in {:.2f} s".format(time.perf_counter() - start))
+        stats = server.stats()
+        print("calls:", stats["calls"])
+        print("average latency (µs):", {name: round(seconds * 1e6) for name, seconds in stats["average_latency"].items()})
+        print("cache hit ratio: {:.1%}".format(stats["cache_hit_ratio"]))
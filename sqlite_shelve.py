@@ -0,0 +1,249 @@
+"""
+Shelves stored in SQLite
+shelve.open() stores its data with the dbm module, and when neither dbm.gnu nor dbm.ndbm is installed - as the test.dat / test.dir / test.bak files show - that's dbm.dumb: slow, never reclaiming space, and unsafe as soon as two processes use the same files.
+
+But shelve.Shelf works on top of any object that maps bytes keys to bytes values, like a dbm database does. SQLiteDict is such an object, backed by the sqlite3 module of the standard library and one table:
+
+CREATE TABLE shelf (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID
+
+and SQLiteShelf is simply shelve.Shelf on top of it, so pickling, writeback and the dictionary interface work exactly as with shelve.open().
+
+The database is set up for this kind of use:
+
+journal_mode=WAL: writers append to a write-ahead log instead of overwriting the database, so readers - other connections, other processes - keep reading the last committed state while a writer is active, and never block it;
+synchronous=NORMAL: in WAL mode a commit is safe against crashes of the program without waiting for an fsync of every transaction;
+mmap_size: the database file is memory-mapped, so reads come straight from the page cache without a read() system call;
+the SQL statements are constant strings, so sqlite3 compiles each of them once and reuses the prepared statement from its statement cache.
+
+Every statement outside a transaction would be a transaction of its own, with a commit each time. Writes are therefore batched: the first write opens a transaction, which is committed after batch_size writes, commit_delay seconds after that first write at the latest (a write transaction keeps other connections from writing), on sync() and on close(). transaction() wraps a group of writes in a single transaction explicitly; nested calls become savepoints.
+
+The connection may be used by several threads, so every access to it holds a lock - for a transaction() block, during the whole block.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import collections.abc
+import contextlib
+import os
+import shelve
+import sqlite3
+import threading
+
+BATCH_SIZE = 1000
+MMAP_SIZE = 256 * 2**20
+COMMIT_DELAY = 0.05
+
+
+class SQLiteDict(collections.abc.MutableMapping):
+    def __init__(self, filename, flag="c", batch_size=BATCH_SIZE, mmap_size=MMAP_SIZE, commit_delay=COMMIT_DELAY):
+        if flag == "r":
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(filename), uri=True, isolation_level=None, check_same_thread=False)
+        else:
+            if flag == "w" and not os.path.exists(filename):
+                raise FileNotFoundError("no shelf named {!r}".format(filename))
+            self.connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS shelf (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID")
+            if flag == "n":
+                self.connection.execute("DELETE FROM shelf")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA mmap_size={:d}".format(mmap_size))
+        self.batch_size = batch_size
+        self.commit_delay = commit_delay
+        # the connection is shared by the threads: one at a time, and a transaction() keeps it
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._depth = 0
+        self._timer = None
+
+    def _written(self):
+        # called with _lock held
+        if self._depth:
+            return
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+        elif self._timer is None:
+            # don't keep other connections waiting for the rest of a batch that may never come
+            self._timer = threading.Timer(self.commit_delay, self.commit)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _begin(self):
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+
+    def commit(self):
+        """Commits the writes batched so far (not those of a transaction() still running)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._depth or self.connection is None:
+                return
+            if self.connection.in_transaction:
+                self.connection.execute("COMMIT")
+            self._pending = 0
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups the writes of a with block in one transaction (rolled back on an exception).
+
+        Nested calls use savepoints: an exception rolls back the inner block only."""
+        with self._lock:
+            if self._depth:
+                savepoint = "level{}".format(self._depth)
+                self.connection.execute("SAVEPOINT " + savepoint)
+            else:
+                savepoint = None
+                self.commit()
+                self._begin()
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                if savepoint is None:
+                    self.connection.execute("ROLLBACK")
+                else:
+                    self.connection.execute("ROLLBACK TO " + savepoint)
+                    self.connection.execute("RELEASE " + savepoint)
+                raise
+            else:
+                if savepoint is None:
+                    self.connection.execute("COMMIT")
+                else:
+                    self.connection.execute("RELEASE " + savepoint)
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self._pending = 0
+
+    def __getitem__(self, key):
+        with self._lock:
+            row = self.connection.execute("SELECT value FROM shelf WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self.connection.execute("SELECT 1 FROM shelf WHERE key = ?", (key,)).fetchone() is not None
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._begin()
+            self.connection.execute("INSERT OR REPLACE INTO shelf (key, value) VALUES (?, ?)", (key, value))
+            self._written()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._begin()
+            if not self.connection.execute("DELETE FROM shelf WHERE key = ?", (key,)).rowcount:
+                raise KeyError(key)
+            self._written()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM shelf").fetchone()[0]
+
+    def __iter__(self):
+        with self._lock:
+            keys = self.connection.execute("SELECT key FROM shelf").fetchall()
+        for (key,) in keys:
+            yield key
+
+    def sync(self):
+        self.commit()
+
+    def close(self):
+        with self._lock:
+            if self.connection is None:
+                return
+            try:
+                self.commit()
+            finally:
+                self.connection.close()
+                self.connection = None
+
+
+class SQLiteShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, writeback=False, batch_size=BATCH_SIZE, mmap_size=MMAP_SIZE, commit_delay=COMMIT_DELAY):
+        shelve.Shelf.__init__(self, SQLiteDict(filename, flag, batch_size, mmap_size, commit_delay), protocol, writeback)
+
+    def transaction(self):
+        return self.dict.transaction()
+
+
+def open_sqlite(filename, flag="c", protocol=None, writeback=False, batch_size=BATCH_SIZE, mmap_size=MMAP_SIZE, commit_delay=COMMIT_DELAY):
+    return SQLiteShelf(filename, flag, protocol, writeback, batch_size, mmap_size, commit_delay)
+
+
+if __name__ == "__main__":
+    import dbm.dumb
+    import glob
+    import importlib
+    import threading
+    import time
+
+    shelve_name = "first_shelve.sqlite"
+
+    with open_sqlite(shelve_name, flag="n") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+
+    with open_sqlite(shelve_name, flag="r") as my_shelve:
+        print(sorted(my_shelve.keys()), my_shelve["USD"])
+
+    # a reader sees whole transactions only, while the writer keeps writing
+    with open_sqlite("test_sqlite", flag="n") as writer:
+        seen = set()
+        done = threading.Event()
+
+        def read():
+            with open_sqlite("test_sqlite", flag="r") as reader:
+                while not done.is_set():
+                    seen.add(len(reader))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        for batch in range(20):
+            with writer.transaction():
+                for i in range(500):
+                    writer["key{}".format(batch * 500 + i)] = i
+            time.sleep(0.01)
+        done.set()
+        thread.join()
+        print("lengths seen by the reader:", sorted(seen))
+
+    N = 20000
+    backends = [("dbm.dumb", lambda name: shelve.Shelf(dbm.dumb.open(name, "n")))]
+    for module in ("dbm.gnu", "dbm.ndbm"):
+        try:
+            backend = importlib.import_module(module)
+        except ImportError:
+            print(module, "is not available")
+            continue
+        backends.append((module, lambda name, backend=backend: shelve.Shelf(backend.open(name, "n"))))
+    backends.append(("sqlite3", lambda name: open_sqlite(name, flag="n")))
+
+    for name, opener in backends:
+        filename = "bench_" + name.replace(".", "_")
+        with opener(filename) as shelf:
+            start = time.perf_counter()
+            for i in range(N):
+                shelf["key{}".format(i)] = {"id": i, "code": "Euro", "symbol": "€"}
+            shelf.sync()
+            write = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(N):
+                shelf["key{}".format(i)]
+            read = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(N):
+                "other{}".format(i) in shelf
+            miss = time.perf_counter() - start
+        print("{:9} writes {:8.0f}/s   reads {:8.0f}/s   misses {:8.0f}/s".format(name, N / write, N / read, N / miss))
+        for path in glob.glob(filename + "*"):
+            os.remove(path)
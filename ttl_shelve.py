@@ -0,0 +1,240 @@
+"""
+Using a shelf as a cache with expiry and eviction
+A shelf is a convenient persistent cache: results of slow computations or downloads survive a restart. But nothing ever leaves it, so it grows forever, and stale entries are served as if they were fresh.
+
+CacheShelf adds the two rules every cache needs:
+
+expiry: every value is stored with the time after which it's no longer valid (ttl seconds after it was set; ttl=None means never). An expired value is deleted the first time somebody tries to read it ('lazy' expiry), and a sweeper thread, started with sweep_interval, deletes the ones nobody reads;
+size bounds: with max_size (number of entries) and/or max_bytes (size of the pickled values), storing a new value evicts the least recently used entries until the cache fits again.
+
+The expiry time is stored as 8 bytes in front of the pickled value, so it can be read without unpickling. Recency is kept in memory in an OrderedDict, where marking a key as used is a single move_to_end(). When the shelf is opened, the existing entries are scanned once (without unpickling) to learn their sizes and expiry times; they start in the order the database lists them.
+
+Expired and evicted entries disappear from the in-memory bookkeeping immediately, but are deleted from the database in batches (and on sweep() and sync()): dbm.dumb rewrites its whole '.dir' file after every single deletion. A cache opened with flag "r" never writes: its expired entries are only hidden.
+
+hits, misses, expirations and evictions are counted, and stats() returns them.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import dbm.dumb
+import math
+import pickle
+import shelve
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+HEADER = struct.Struct("<d")
+_DEFAULT = object()
+
+
+class CacheShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, ttl=None, max_size=None, max_bytes=None, sweep_interval=None):
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.readonly = flag == "r"
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self._garbage = set()
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        now = time.time()
+        for encoded in list(self.dict.keys()):
+            data = self.dict[encoded]
+            key = encoded.decode(self.keyencoding)
+            expires = HEADER.unpack_from(data)[0]
+            if expires <= now:
+                self._drop(key)
+                self.expirations += 1
+            else:
+                self.entries[key] = (expires, len(data))
+                self.bytes += len(data)
+        self._evict()
+        self._purge()
+        self._sweeper = None
+        if sweep_interval:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,), daemon=True)
+            self._sweeper.start()
+
+    def _drop(self, key):
+        # called with _lock held; the database is cleaned up later, in batches
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        if self.readonly:
+            return
+        self._garbage.add(key.encode(self.keyencoding))
+        if len(self._garbage) >= 1000:
+            self._purge()
+
+    def _purge(self):
+        # called with _lock held
+        if not self._garbage:
+            return
+        if isinstance(self.dict, dbm.dumb._Database):
+            # dbm.dumb rewrites its whole '.dir' file after every deletion; do it once for the batch
+            for encoded in self._garbage:
+                self.dict._index.pop(encoded, None)
+            self.dict._modified = True
+            self.dict._commit()
+        else:
+            for encoded in self._garbage:
+                try:
+                    del self.dict[encoded]
+                except KeyError:
+                    pass
+        self._garbage.clear()
+
+    def _evict(self):
+        # called with _lock held
+        while self.entries and (
+            (self.max_size is not None and len(self.entries) > self.max_size)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            key = next(iter(self.entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def set(self, key, value, ttl=_DEFAULT):
+        """Stores value for ttl seconds (the shelf's default ttl if not given, forever if None)."""
+        ttl = self.ttl if ttl is _DEFAULT else ttl
+        expires = math.inf if ttl is None else time.time() + ttl
+        data = HEADER.pack(expires) + pickle.dumps(value, self._protocol)
+        encoded = key.encode(self.keyencoding)
+        with self._lock:
+            self._garbage.discard(encoded)
+            self.dict[encoded] = data
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (expires, len(data))
+            self.bytes += len(data)
+            self._evict()
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            if entry[0] <= time.time():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                raise KeyError(key)
+            self.entries.move_to_end(key)
+            self.hits += 1
+            data = self.dict[key.encode(self.keyencoding)]
+        return pickle.loads(data[HEADER.size:])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self.entries:
+                raise KeyError(key)
+            self._drop(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def __len__(self):
+        now = time.time()
+        with self._lock:
+            return sum(1 for expires, size in self.entries.values() if expires > now)
+
+    def __iter__(self):
+        now = time.time()
+        with self._lock:
+            keys = [key for key, (expires, size) in self.entries.items() if expires > now]
+        return iter(keys)
+
+    def sweep(self):
+        """Deletes every expired entry and returns how many there were."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expires, size) in self.entries.items() if expires <= now]
+            for key in expired:
+                self._drop(key)
+            self.expirations += len(expired)
+            self._purge()
+        return len(expired)
+
+    def _sweep_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.sweep()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+    def sync(self):
+        with self._lock:
+            if self._garbage and not isinstance(self.dict, shelve._ClosedDict):
+                self._purge()
+            shelve.Shelf.sync(self)
+
+    def close(self):
+        if getattr(self, "_sweeper", None) is not None:
+            self._stop.set()
+            self._sweeper.join()
+            self._sweeper = None
+        shelve.Shelf.close(self)
+
+
+def open_cache(filename, flag="c", protocol=None, ttl=None, max_size=None, max_bytes=None, sweep_interval=None):
+    return CacheShelf(filename, flag, protocol, ttl, max_size, max_bytes, sweep_interval)
+
+
+if __name__ == "__main__":
+    shelve_name = "first_shelve.shlv"
+
+    with open_cache(shelve_name, flag="n", ttl=0.2, max_size=3) as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve.get("EUR")
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}  # evicts GBP, the least recently used
+        my_shelve.set("CHF", {"code": "Swiss franc", "symbol": "Fr."}, ttl=None)
+        print(sorted(my_shelve), my_shelve.get("GBP"))
+        time.sleep(0.3)
+        print(sorted(my_shelve), my_shelve.get("USD"), my_shelve["CHF"])
+        print(my_shelve.stats())
+
+    import random
+
+    rng = random.Random(0)
+    with open_cache("test_cache", flag="n", ttl=0.5, max_bytes=2**20, sweep_interval=0.1) as cache:
+        start = time.perf_counter()
+        for i in range(50000):
+            key = "page{}".format(int(5000 * rng.random() ** 3))  # a few pages are much more popular
+            if cache.get(key) is None:
+                cache[key] = "<html>{}</html>".format(key) * 20
+        print("{:.2f} s".format(time.perf_counter() - start), cache.stats())
+        time.sleep(0.7)
+        print("after the sweeper:", cache.stats()["entries"], "entries")
@@ -0,0 +1,255 @@
+"""
+Durable shelves with a write-ahead log and group commit
+shelve_module.py notes that you can call sync() to force the changes to disk. Calling it after every write is slow: dbm rewrites its index, and a real guarantee also needs os.fsync(), which waits for the disk. Not calling it means a crash can lose any write since the last sync().
+
+Databases solve this with a write-ahead log (WAL):
+
+every mutation is appended to a log file - an append is cheap and sequential;
+a write is durable as soon as its log record is fsync'ed, even if the main database file hasn't been updated yet;
+after a crash, the log is replayed into the database when it's opened again;
+from time to time the database itself is synced ('checkpointed') and the log is truncated.
+
+The fsync is still the expensive part, so the log uses 'group commit': a commit thread waits up to commit_window seconds for writers to pile up, then writes all their records and fsyncs once. Each writer blocks until the fsync covering its record is done, so a burst of 100 concurrent writes costs one fsync instead of 100.
+
+Every log record carries its length and a CRC32 checksum, so a record torn by a crash in the middle of a write is detected and ignored during replay.
+
+A background thread checkpoints the shelf every checkpoint_interval seconds, or earlier when the log grows past checkpoint_bytes.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import os
+import pickle
+import shelve
+import struct
+import threading
+import time
+import zlib
+
+RECORD = struct.Struct("<II")
+SET = 0
+DELETE = 1
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_log(path):
+    """Yields the (operation, key, data) records of a log, stopping at the first damaged one."""
+    try:
+        file_in = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with file_in:
+        while True:
+            header = file_in.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            length, checksum = RECORD.unpack(header)
+            payload = file_in.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            yield pickle.loads(payload)
+
+
+class DurableShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, commit_window=0.002, checkpoint_interval=5.0, checkpoint_bytes=16 * 2**20):
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        self.filename = filename
+        self.log_path = filename + ".wal"
+        self.commit_window = commit_window
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.commits = 0
+        self.records = 0
+        self._db_lock = threading.RLock()
+        self._log_lock = threading.Condition()
+        self._pending = []
+        self._next_seq = 0
+        self._durable_seq = 0
+        self._closing = False
+        self._replay()
+        self._log = open(self.log_path, "ab")
+        self._log_size = self._log.tell()
+        self._committer = threading.Thread(target=self._commit_loop, daemon=True)
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, daemon=True)
+        self._committer.start()
+        self._checkpointer.start()
+
+    def _replay(self):
+        replayed = 0
+        for operation, key, data in read_log(self.log_path):
+            if operation == SET:
+                self.dict[key] = data
+            else:
+                try:
+                    del self.dict[key]
+                except KeyError:
+                    pass
+            replayed += 1
+        if replayed:
+            self._sync_db()
+        with open(self.log_path, "wb") as file_out:
+            os.fsync(file_out.fileno())
+        self.replayed = replayed
+
+    def _sync_db(self):
+        if hasattr(self.dict, "sync"):
+            self.dict.sync()
+        for suffix in ("", ".dat", ".dir", ".db", ".pag"):
+            _fsync_path(self.filename + suffix)
+
+    def _enqueue(self, operation, key, data):
+        # called with _db_lock held, so the log order is the order of the dbm updates
+        payload = pickle.dumps((operation, key, data), pickle.HIGHEST_PROTOCOL)
+        with self._log_lock:
+            self._pending.append(RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._next_seq += 1
+            self._log_lock.notify_all()
+            return self._next_seq
+
+    def _wait_durable(self, seq):
+        with self._log_lock:
+            while self._durable_seq < seq:
+                self._log_lock.wait()
+
+    def _write_pending(self):
+        # called with _log_lock held
+        batch, self._pending = self._pending, []
+        data = b"".join(batch)
+        self._log.write(data)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_size += len(data)
+        self.commits += 1
+        self.records += len(batch)
+        self._durable_seq += len(batch)
+        self._log_lock.notify_all()
+
+    def _commit_loop(self):
+        while True:
+            with self._log_lock:
+                while not self._pending and not self._closing:
+                    self._log_lock.wait()
+                if self._closing and not self._pending:
+                    return
+            # let more writers join this group
+            time.sleep(self.commit_window)
+            with self._log_lock:
+                if self._pending:
+                    self._write_pending()
+
+    def _checkpoint_loop(self):
+        last = time.monotonic()
+        while not self._closing:
+            time.sleep(min(0.05, self.checkpoint_interval))
+            if self._log_size >= self.checkpoint_bytes or time.monotonic() - last >= self.checkpoint_interval:
+                self.checkpoint()
+                last = time.monotonic()
+
+    def checkpoint(self):
+        """Makes the dbm files durable and empties the log."""
+        with self._db_lock, self._log_lock:
+            if self._log.closed:
+                return
+            if self._pending:
+                self._write_pending()
+            if not self._log_size:
+                return
+            self._sync_db()
+            self._log.truncate(0)
+            self._log.seek(0)
+            os.fsync(self._log.fileno())
+            self._log_size = 0
+
+    def __getitem__(self, key):
+        with self._db_lock:
+            return shelve.Shelf.__getitem__(self, key)
+
+    def __contains__(self, key):
+        with self._db_lock:
+            return shelve.Shelf.__contains__(self, key)
+
+    def __len__(self):
+        with self._db_lock:
+            return len(self.dict)
+
+    def __iter__(self):
+        with self._db_lock:
+            keys = list(self.dict.keys())
+        for key in keys:
+            yield key.decode(self.keyencoding)
+
+    def __setitem__(self, key, value):
+        data = pickle.dumps(value, self._protocol)
+        encoded = key.encode(self.keyencoding)
+        with self._db_lock:
+            self.dict[encoded] = data
+            seq = self._enqueue(SET, encoded, data)
+        self._wait_durable(seq)
+
+    def __delitem__(self, key):
+        encoded = key.encode(self.keyencoding)
+        with self._db_lock:
+            del self.dict[encoded]
+            seq = self._enqueue(DELETE, encoded, None)
+        self._wait_durable(seq)
+
+    def sync(self):
+        self.checkpoint()
+
+    def close(self):
+        if self.dict is None or isinstance(self.dict, shelve._ClosedDict):
+            return
+        if not hasattr(self, "_checkpointer"):
+            # __init__ failed half way
+            return shelve.Shelf.close(self)
+        with self._log_lock:
+            self._closing = True
+            self._log_lock.notify_all()
+        self._committer.join()
+        self._checkpointer.join()
+        self.checkpoint()
+        self._log.close()
+        shelve.Shelf.close(self)
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "commits": self.commits,
+            "records_per_commit": self.records / self.commits if self.commits else 0.0,
+            "log_bytes": self._log_size,
+        }
+
+
+def open_durable(filename, flag="c", protocol=None, commit_window=0.002, checkpoint_interval=5.0):
+    return DurableShelf(filename, flag, protocol, commit_window, checkpoint_interval)
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open_durable("test_wal", commit_window=0.005) as shelvi:
+        shelvi["username"] = "Hafedh Gunichi"
+        print("replayed on open:", shelvi.replayed)
+
+        def write(i):
+            shelvi["user{}".format(i)] = {"id": i, "code": "Euro", "symbol": "€"}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            list(pool.map(write, range(2000)))
+        elapsed = time.perf_counter() - start
+        print("2000 durable writes from 32 threads: {:.3f} s".format(elapsed), shelvi.stats())
+
+    with shelve.open("test_wal") as shelvi:
+        print(shelvi["username"], len(shelvi))
@@ -0,0 +1,233 @@
+"""
+Write-behind shelves
+Every assignment to a shelf pickles the value and writes it to the dbm files before returning. When the same keys are updated over and over - counters, the latest position of something, a session - most of those writes are wasted: only the last value of each key matters.
+
+WriteBehindShelf returns from an assignment as soon as the pickled value is in an in-memory 'pending' map. A background thread writes the pending map to the database every flush_interval seconds (or earlier when it gets big):
+
+writes are coalesced: if a key is assigned ten times between two flushes, it's written to the database once;
+reads look into the pending map first, so you always read back what you wrote;
+the pending map is bounded: when it holds max_pending keys, the next assignment of a new key waits until the background thread has made room (backpressure), so a fast producer can't fill the memory;
+flush() is a barrier: it returns when every write made before the call is in the database, and sync() and close() call it.
+
+An error in the background thread (a full disk, say) is raised again by the next operation, so it can't go unnoticed.
+
+The price is durability: writes still pending when the process is killed are lost. Call flush() where it matters, or see wal_shelve.py.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import pickle
+import shelve
+import threading
+import time
+
+_DELETED = object()
+
+
+class WriteBehindShelf(shelve.Shelf):
+    def __init__(self, filename, flag="c", protocol=None, max_pending=10000, flush_interval=0.5):
+        shelve.Shelf.__init__(self, dbm.open(filename, flag), protocol)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.writes = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.batches = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self._pending = {}
+        self._flushing = {}
+        self._seq = 0
+        self._flushed_seq = 0
+        self._flush_requested = False
+        self._closing = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _check(self):
+        # called with _condition held
+        if self._error is not None:
+            raise RuntimeError("background flush failed") from self._error
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not (self._closing or self._flush_requested or len(self._pending) >= self.max_pending // 2):
+                    if not self._condition.wait(self.flush_interval):
+                        break
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+                seq = self._seq
+                self._flush_requested = False
+                self._condition.notify_all()
+            try:
+                with self._db_lock:
+                    for key, data in batch.items():
+                        encoded = key.encode(self.keyencoding)
+                        if data is _DELETED:
+                            try:
+                                del self.dict[encoded]
+                            except KeyError:
+                                pass
+                        else:
+                            self.dict[encoded] = data
+            except BaseException as error:
+                with self._condition:
+                    self._error = error
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._flushing = {}
+                self._flushed_seq = seq
+                self.flushed += len(batch)
+                if batch:
+                    self.batches += 1
+                self._condition.notify_all()
+                if self._closing and not self._pending:
+                    return
+
+    def _put(self, key, data):
+        with self._condition:
+            self._check()
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                start = time.perf_counter()
+                self.throttled += 1
+                self._condition.notify_all()
+                while len(self._pending) >= self.max_pending and self._error is None:
+                    self._condition.wait()
+                self.throttle_seconds += time.perf_counter() - start
+                self._check()
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = data
+            self._seq += 1
+            self.writes += 1
+            if len(self._pending) >= self.max_pending // 2:
+                self._condition.notify_all()
+
+    def _lookup(self, key):
+        with self._condition:
+            self._check()
+            for pending in (self._pending, self._flushing):
+                if key in pending:
+                    return pending[key]
+        with self._db_lock:
+            return self.dict.get(key.encode(self.keyencoding), _DELETED)
+
+    def __getitem__(self, key):
+        data = self._lookup(key)
+        if data is _DELETED:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _DELETED
+
+    def __setitem__(self, key, value):
+        self._put(key, pickle.dumps(value, self._protocol))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._put(key, _DELETED)
+
+    def __len__(self):
+        self.flush()
+        with self._db_lock:
+            return len(self.dict)
+
+    def __iter__(self):
+        self.flush()
+        with self._db_lock:
+            keys = list(self.dict.keys())
+        for key in keys:
+            yield key.decode(self.keyencoding)
+
+    def flush(self):
+        """Waits until every write made so far is in the database."""
+        if not self._closing:
+            with self._condition:
+                target = self._seq
+                self._flush_requested = True
+                self._condition.notify_all()
+                while self._flushed_seq < target and self._error is None:
+                    self._condition.wait()
+                self._check()
+        with self._db_lock:
+            if hasattr(self.dict, "sync"):
+                self.dict.sync()
+
+    def sync(self):
+        self.flush()
+
+    def close(self):
+        if self.dict is None or isinstance(self.dict, shelve._ClosedDict):
+            return
+        if not hasattr(self, "_flusher"):
+            # __init__ failed half way
+            return shelve.Shelf.close(self)
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closing = True
+                self._condition.notify_all()
+            self._flusher.join()
+            shelve.Shelf.close(self)
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "throttled": self.throttled,
+            "throttle_seconds": self.throttle_seconds,
+        }
+
+
+def open_write_behind(filename, flag="c", protocol=None, max_pending=10000, flush_interval=0.5):
+    return WriteBehindShelf(filename, flag, protocol, max_pending, flush_interval)
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+
+    shelve_name = "first_shelve.shlv"
+
+    with open_write_behind(shelve_name, flag="n") as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+        del my_shelve["GBP"]
+        print(my_shelve["USD"], "GBP" in my_shelve)
+
+    with shelve.open(shelve_name) as new_shelve:
+        print(sorted(new_shelve.keys()))
+
+    UPDATES = 100000
+
+    start = time.perf_counter()
+    with shelve.open("test_plain", flag="n") as shelf:
+        for i in range(UPDATES):
+            shelf["counter{}".format(i % 1000)] = i
+    print("plain shelf: {:.2f} s".format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with open_write_behind("test_behind", flag="n", flush_interval=0.1) as shelf:
+        for i in range(UPDATES):
+            shelf["counter{}".format(i % 1000)] = i
+        shelf.flush()
+        print("write-behind: {:.2f} s".format(time.perf_counter() - start), shelf.stats())
+
+    with shelve.open("test_behind") as shelf:
+        assert shelf["counter999"] == UPDATES - 1 and len(shelf) == 1000
+
+    for path in glob.glob("test_plain*") + glob.glob("test_behind*"):
+        os.remove(path)
@@ -0,0 +1,125 @@
+"""
+A shelf that remembers in-place changes without rewriting everything
+shelve_module.py opens its shelves with the default writeback=False. In that mode a value read from the shelf is a fresh copy, so this change is silently lost:
+
+my_shelve["EUR"]["symbol"] = "EUR"   # modifies a copy, nothing is written
+
+With writeback=True the shelf keeps every value it has ever returned in a cache and writes all of them back on sync() and close() - whether they were modified or not - and the cache grows without limit.
+
+LRUShelf is the middle ground:
+
+the cache is bounded: it holds at most 'capacity' decoded values, and the least recently used one is evicted when a new one comes in;
+for every cached value the shelf remembers a hash of the pickled bytes it was read from (or written as);
+on eviction and on sync() the value is pickled again and written only if the hash differs - that is, only if it was really changed.
+
+Assignments (my_shelve["EUR"] = ...) are still written immediately, so len(), 'in' and iteration always agree with the file.
+"""
+
+# --------------------------------------------------------------------------------------------
+
+import dbm
+import hashlib
+import pickle
+import shelve
+from collections import OrderedDict
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class LRUShelf(shelve.Shelf):
+    def __init__(self, dict, capacity=1024, protocol=None, keyencoding="utf-8"):
+        shelve.Shelf.__init__(self, dict, protocol, False, keyencoding)
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.writes = 0
+        self.skipped = 0
+
+    def _store(self, key, value):
+        data = pickle.dumps(value, self._protocol)
+        self.dict[key.encode(self.keyencoding)] = data
+        self.writes += 1
+        return _digest(data)
+
+    def _flush(self, key, value, digest):
+        data = pickle.dumps(value, self._protocol)
+        new_digest = _digest(data)
+        if new_digest == digest:
+            self.skipped += 1
+            return digest
+        self.dict[key.encode(self.keyencoding)] = data
+        self.writes += 1
+        return new_digest
+
+    def _remember(self, key, value, digest):
+        self.cache[key] = [value, digest]
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            old_key, (old_value, old_digest) = self.cache.popitem(last=False)
+            self._flush(old_key, old_value, old_digest)
+
+    def __getitem__(self, key):
+        try:
+            entry = self.cache[key]
+        except KeyError:
+            data = self.dict[key.encode(self.keyencoding)]
+            value = pickle.loads(data)
+            self._remember(key, value, _digest(data))
+            return value
+        self.cache.move_to_end(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self._remember(key, value, self._store(key, value))
+
+    def __delitem__(self, key):
+        self.cache.pop(key, None)
+        del self.dict[key.encode(self.keyencoding)]
+
+    def dirty_keys(self):
+        """The cached keys whose values differ from what is stored."""
+        return [
+            key
+            for key, (value, digest) in self.cache.items()
+            if _digest(pickle.dumps(value, self._protocol)) != digest
+        ]
+
+    def sync(self):
+        if isinstance(self.dict, shelve._ClosedDict):
+            return
+        for key, entry in self.cache.items():
+            entry[1] = self._flush(key, *entry)
+        if hasattr(self.dict, "sync"):
+            self.dict.sync()
+
+    def close(self):
+        if self.dict is None:
+            return
+        try:
+            shelve.Shelf.close(self)
+        finally:
+            self.cache = OrderedDict()
+
+
+def open(filename, flag="c", capacity=1024, protocol=None):
+    return LRUShelf(dbm.open(filename, flag), capacity, protocol)
+
+
+if __name__ == "__main__":
+    shelve_name = "first_shelve.shlv"
+
+    with open(shelve_name, flag="n", capacity=2) as my_shelve:
+        my_shelve["EUR"] = {"code": "Euro", "symbol": "€"}
+        my_shelve["GBP"] = {"code": "Pounds sterling", "symbol": "£"}
+        my_shelve["USD"] = {"code": "US dollar", "symbol": "$"}
+        my_shelve["JPY"] = {"code": "Japanese yen", "symbol": "¥"}
+        my_shelve["USD"]["code"] = "United States dollar"
+        print("dirty:", my_shelve.dirty_keys())
+        my_shelve["EUR"]["symbol"] = "EUR"  # evicts an entry, which is unchanged so not rewritten
+        my_shelve.sync()
+        print("writes:", my_shelve.writes, "skipped:", my_shelve.skipped)
+
+    with shelve.open(shelve_name) as new_shelve:
+        print(new_shelve["USD"])
+        print(new_shelve["EUR"])